@@ -1,6 +1,13 @@
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
 
+from profiler import timed
+from config import ADF_MAX_LAG, ADF_MAX_POINTS
+
+# statsmodels pulls in most of scipy (over a second to import), so it is
+# only imported inside adf_test, which runs on the analytics worker thread
+
+@timed("analytics.prepare_df")
 def prepare_df(rows):
     df = pd.DataFrame(rows, columns=["timestamp", "symbol", "price", "qty"])
 
@@ -17,13 +24,12 @@ def prepare_df(rows):
     return df
 
 def hedge_ratio(y, x):
-    y = y.reset_index(drop=True)
-    x = x.reset_index(drop=True)
-
-    x = sm.add_constant(x.values)
-    model = sm.OLS(y.values, x).fit()
-    return model.params[1]
+    """OLS slope of y on x with an intercept"""
+    X = np.column_stack([np.ones(len(x)), x.to_numpy(dtype=float)])
+    params, *_ = np.linalg.lstsq(X, y.to_numpy(dtype=float), rcond=None)
+    return params[1]
 
+@timed("analytics.spread_and_hedge")
 def spread_and_hedge(df1, df2):
     h = hedge_ratio(df1["price"], df2["price"])
     spread = (
@@ -32,17 +38,21 @@ def spread_and_hedge(df1, df2):
     )
     return spread, h
 
+@timed("analytics.zscore")
 def zscore(series, window):
     return (series - series.rolling(window).mean()) / series.rolling(window).std()
 
+@timed("analytics.resample_ohlc")
 def resample_ohlc(df, timeframe):
     """
-    timeframe: '1s', '1m', '5m'
+    timeframe: '1s', '1m', '5m', '15m', '1h'
     """
     rule_map = {
         "1s": "1s",
         "1m": "1min",
-        "5m": "5min"
+        "5m": "5min",
+        "15m": "15min",
+        "1h": "1h"
     }
 
     rule = rule_map[timeframe]
@@ -65,21 +75,179 @@ def resample_ohlc(df, timeframe):
     result = pd.concat([ohlc, volume], axis=1).dropna().reset_index()
     return result
 
+def _bar_measure(kind, price, qty):
+    """Per-tick contribution towards the bar threshold"""
+    if kind == "tick":
+        return np.ones(len(price))
+    if kind == "volume":
+        return qty
+    if kind == "dollar":
+        return price * qty
+    raise ValueError(f"Unknown bar type: {kind}")
+
+@timed("analytics.event_bars")
+def event_bars(df, kind, threshold):
+    """
+    Tick, volume or dollar bars in one vectorized pass.
+
+    A bar closes on the first tick where the cumulative tick count, qty or
+    notional crosses the next multiple of `threshold`; any overshoot carries
+    into the following bar. Only completed bars are returned, labelled by
+    the timestamp of their closing tick, with the same columns as
+    resample_ohlc.
+    """
+    df = df.sort_values("timestamp", kind="stable")
+    price = df["price"].to_numpy(dtype=float)
+    qty = df["qty"].to_numpy(dtype=float)
+    columns = ["timestamp", "open", "high", "low", "close", "volume"]
+    if len(price) == 0:
+        return pd.DataFrame(columns=columns)
+
+    cum = np.cumsum(_bar_measure(kind, price, qty))
+    # A bar closes wherever the number of thresholds crossed goes up; a
+    # single tick can cross several thresholds and still closes one bar
+    ends = np.flatnonzero(np.diff(cum // threshold, prepend=0))
+    if len(ends) == 0:
+        return pd.DataFrame(columns=columns)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Drop the trailing partial bar so the last reduceat segment stops at its close
+    last = ends[-1] + 1
+    price, qty = price[:last], qty[:last]
+
+    return pd.DataFrame({
+        "timestamp": df["timestamp"].to_numpy()[ends],
+        "open": price[starts],
+        "high": np.maximum.reduceat(price, starts),
+        "low": np.minimum.reduceat(price, starts),
+        "close": price[ends],
+        "volume": np.add.reduceat(qty, starts),
+    })
+
+class EventBarBuilder:
+    """
+    Streaming counterpart of event_bars: feed ticks one at a time and get
+    each completed bar back, identical to the batch result.
+    """
+
+    def __init__(self, kind, threshold):
+        _bar_measure(kind, np.empty(0), np.empty(0))
+        self.kind = kind
+        self.threshold = threshold
+        self._cum = 0.0
+        self._next = threshold
+        self._bar = None
+
+    def update(self, ts, price, qty):
+        """Add one tick; returns the completed bar as a dict, or None"""
+        if self.kind == "tick":
+            self._cum += 1
+        elif self.kind == "volume":
+            self._cum += qty
+        else:
+            self._cum += price * qty
+
+        bar = self._bar
+        if bar is None:
+            bar = self._bar = {"open": price, "high": price, "low": price, "volume": 0.0}
+        bar["high"] = max(bar["high"], price)
+        bar["low"] = min(bar["low"], price)
+        bar["volume"] += qty
+
+        if self._cum < self._next:
+            return None
+        self._next = (self._cum // self.threshold + 1) * self.threshold
+        self._bar = None
+        return {"timestamp": ts, **bar, "close": price}
+
+def build_bars(df, timeframe, threshold=None):
+    """
+    Dispatch to clock bars ('1s', '1m', '5m') or event bars ('tick',
+    'volume', 'dollar' with a threshold)
+    """
+    if timeframe in ("tick", "volume", "dollar"):
+        return event_bars(df, timeframe, threshold)
+    return resample_ohlc(df, timeframe)
+
+def quote_prices(quotes, source):
+    """
+    Price series from top-of-book quotes: 'mid' is the bid/ask midpoint,
+    'microprice' weights each side by the opposite side's size, leaning
+    towards the side about to be consumed. Returns timestamp, symbol, price.
+    """
+    bid, ask = quotes["bid"], quotes["ask"]
+    if source == "mid":
+        price = (bid + ask) / 2
+    elif source == "microprice":
+        depth = quotes["bid_qty"] + quotes["ask_qty"]
+        price = (bid * quotes["ask_qty"] + ask * quotes["bid_qty"]) / depth
+        price = price.where(depth > 0, (bid + ask) / 2)
+    else:
+        raise ValueError(f"Unknown price source: {source}")
+    return pd.DataFrame({"timestamp": quotes["timestamp"], "symbol": quotes["symbol"], "price": price})
+
+@timed("analytics.quote_closes")
+def quote_closes(price_bars, prices, offset=None):
+    """
+    Replace each bar's close with the last quote price before the bar
+    closes. Event bars close at their timestamp; clock bars are labelled by
+    their start, so pass the bar length as `offset`. Bars before the first
+    quote are dropped.
+    """
+    if price_bars.empty:
+        return price_bars
+    close_at = price_bars["timestamp"].astype("datetime64[ns]")
+    if offset is not None:
+        close_at = close_at + offset
+    bars = price_bars.assign(close_at=close_at).sort_values("close_at", kind="stable")
+    # Same key dtypes on both sides, whatever each frame was built from
+    bars["symbol"] = bars["symbol"].astype(object)
+    prices = prices.assign(
+        close_at=prices["timestamp"].astype("datetime64[ns]"),
+        symbol=prices["symbol"].astype(object),
+    )
+    merged = pd.merge_asof(
+        bars.drop(columns="close"),
+        prices[["close_at", "symbol", "price"]]
+        .sort_values("close_at", kind="stable")
+        .rename(columns={"price": "close"}),
+        on="close_at",
+        by="symbol",
+        # A clock bar's quote must fall strictly inside the bar
+        allow_exact_matches=offset is None,
+    )
+    return merged.dropna(subset=["close"]).drop(columns="close_at")
+
+def aligned_closes(price_chart_df, s1, s2):
+    """
+    Align two symbols' bar closes on the union of their bar timestamps,
+    carrying each leg's last close forward, as price frames for
+    spread_and_hedge
+    """
+    pair = price_chart_df[[s1, s2]].ffill().dropna()
+    return pair[[s1]].rename(columns={s1: "price"}), pair[[s2]].rename(columns={s2: "price"})
+
+@timed("analytics.rolling_correlation")
 def rolling_correlation(series1, series2, window):
     """
     Computes rolling correlation between two price series
     """
     return series1.rolling(window).corr(series2)
-from statsmodels.tsa.stattools import adfuller
 
+@timed("analytics.adf_test")
 def adf_test(series):
     """
     Runs Augmented Dickey-Fuller test on a series
     Returns p-value
+
+    The lag search is capped at ADF_MAX_LAG and only the latest
+    ADF_MAX_POINTS values are tested, so the cost stays bounded on long
+    histories (the default lag bound grows with the sample and dominates).
     """
-    series = series.dropna()
+    from statsmodels.tsa.stattools import adfuller
+
+    series = series.dropna().iloc[-ADF_MAX_POINTS:]
     if len(series) < 20:
         return None
 
-    result = adfuller(series)
+    result = adfuller(series, maxlag=min(ADF_MAX_LAG, len(series) // 2 - 2), autolag="AIC")
     return result[1]  # p-value
@@ -1,17 +1,26 @@
 import streamlit as st
 import threading
 import asyncio
-import pandas as pd
-
-from storage import init_db, get_all_ticks, get_tick_count, cleanup_old_data, clear_all_data
-from ingestion import start_stream, stop_stream
-from analytics import (
-    prepare_df,
-    spread_and_hedge,
-    zscore,
-    resample_ohlc,
-    rolling_correlation,
-    adf_test
+import time
+
+from storage import init_db, get_tick_count, get_gaps, cleanup_old_data, clear_all_data
+from ingestion import start_stream, stop_stream, get_ingestion_stats
+from worker import AnalyticsWorker, AnalyticsParams
+from profiler import stage, record, begin_run, end_run, stage_summary, start_capture, finish_capture
+from config import (
+    SYNTHETIC_TICK_RATE,
+    WORKER_WAIT,
+    AVAILABLE_STREAM_MODES,
+    AVAILABLE_COALESCE_QUANTA,
+    QUOTE_INTERVAL_MS,
+    AVAILABLE_PRICE_SOURCES,
+    FEED_CONNECTIONS,
+    MAX_FEED_CONNECTIONS,
+    AVAILABLE_TIMEFRAMES,
+    EVENT_BAR_THRESHOLDS,
+    EVENT_BAR_MIN_THRESHOLDS,
+    LOOKBACK_OPTIONS,
+    DEFAULT_LOOKBACK,
 )
 
 # ================= PAGE CONFIG =================
@@ -287,288 +296,405 @@ else:
     </style>
     """, unsafe_allow_html=True)
 
-# ================= TITLE =================
-st.markdown("## 📊 Gemscap – Quant Analytics Dashboard")
-init_db()
+begin_run()
+capture = start_capture() if st.session_state.pop("profile_next_run", False) else None
+run_context = {}
 
-# ================= SIDEBAR CONTROLS =================
-st.sidebar.markdown("### 📡 Data Ingestion")
+try:
+    # ================= TITLE =================
+    st.markdown("## 📊 Gemscap – Quant Analytics Dashboard")
+    init_db()
 
-timeframe = st.sidebar.selectbox("Timeframe", ["1s", "1m", "5m"], index=1)
+    # ================= SIDEBAR CONTROLS =================
+    st.sidebar.markdown("### 📡 Data Ingestion")
 
-symbols_input = st.sidebar.text_input(
-    "Symbols (comma-separated)",
-    "btcusdt,ethusdt"
-)
+    timeframe = st.sidebar.selectbox(
+        "Timeframe",
+        AVAILABLE_TIMEFRAMES + list(EVENT_BAR_THRESHOLDS),
+        index=1,
+        format_func=lambda tf: tf if tf in AVAILABLE_TIMEFRAMES else f"{tf.capitalize()} bars"
+    )
+
+    lookback = st.sidebar.selectbox(
+        "Lookback",
+        list(LOOKBACK_OPTIONS),
+        index=list(LOOKBACK_OPTIONS).index(DEFAULT_LOOKBACK)
+    )
+
+    bar_threshold = None
+    if timeframe in EVENT_BAR_THRESHOLDS:
+        bar_threshold = st.sidebar.number_input(
+            f"{timeframe.capitalize()} Bar Threshold",
+            value=float(EVENT_BAR_THRESHOLDS[timeframe]),
+            min_value=EVENT_BAR_MIN_THRESHOLDS[timeframe],
+            help="Ticks, qty or notional accumulated per bar"
+        )
+
+    symbols_input = st.sidebar.text_input(
+        "Symbols (comma-separated)",
+        "btcusdt,ethusdt"
+    )
+
+    symbols = [s.strip().lower() for s in symbols_input.split(",") if s.strip()]
+
+    source = st.sidebar.selectbox("Data Source", ["Binance", "Synthetic"])
+
+    tick_rate = SYNTHETIC_TICK_RATE
+    stream_mode = AVAILABLE_STREAM_MODES[0]
+    connections = FEED_CONNECTIONS
+    if source == "Synthetic":
+        tick_rate = st.sidebar.number_input(
+            "Synthetic Ticks/s per Symbol",
+            value=SYNTHETIC_TICK_RATE,
+            min_value=0.1,
+            max_value=100000.0,
+            step=1.0
+        )
+    else:
+        stream_mode = st.sidebar.selectbox("Stream", AVAILABLE_STREAM_MODES)
+        connections = st.sidebar.number_input(
+            "Connections per Symbol",
+            value=FEED_CONNECTIONS,
+            min_value=1,
+            max_value=MAX_FEED_CONNECTIONS,
+            help="Redundant trade feeds; trades are deduplicated by trade id"
+        )
+
+    quantum_ms = st.sidebar.selectbox(
+        "Coalesce Ticks (ms)",
+        AVAILABLE_COALESCE_QUANTA,
+        format_func=lambda q: "Off" if q == 0 else f"{q} ms"
+    )
 
-symbols = [s.strip().lower() for s in symbols_input.split(",") if s.strip()]
-
-c1, c2 = st.sidebar.columns(2)
-with c1:
-    start_btn = st.button("▶ Start", use_container_width=True, key="start_btn")
-    if start_btn and not st.session_state.streaming:
-        try:
-            def run_async_stream():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(start_stream(symbols))
+    ingest_quotes = st.sidebar.checkbox(
+        "Ingest Quotes (bookTicker)",
+        help=f"Store the last top-of-book quote per {QUOTE_INTERVAL_MS} ms for mid / microprice spreads"
+    )
+
+    c1, c2 = st.sidebar.columns(2)
+    with c1:
+        start_btn = st.button("▶ Start", use_container_width=True, key="start_btn")
+        if start_btn and not st.session_state.streaming:
+            try:
+                def run_async_stream():
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    loop.run_until_complete(
+                        start_stream(
+                            symbols,
+                            source=source.lower(),
+                            tick_rate=tick_rate,
+                            stream_mode=stream_mode,
+                            quantum_ms=quantum_ms,
+                            quotes=ingest_quotes,
+                            connections=connections
+                        )
+                    )
             
-            st.session_state.thread = threading.Thread(target=run_async_stream, daemon=True)
-            st.session_state.thread.start()
-            st.session_state.streaming = True
-            st.success("Stream started! (May take a few seconds to connect)")
-            st.rerun()
-        except Exception as e:
-            st.error(f"Failed to start stream: {e}")
-            st.info("💡 WebSocket connections may be restricted on Streamlit Cloud. Try running locally for full functionality.")
-
-with c2:
-    stop_btn = st.button("⏹ Stop", use_container_width=True, key="stop_btn")
-    if stop_btn and st.session_state.streaming:
-        try:
-            stop_stream()
-            st.session_state.streaming = False
-            st.success("Stream stopped!")
-            st.rerun()
-        except Exception as e:
-            st.error(f"Error stopping stream: {e}")
-
-st.sidebar.markdown("### 📊 Analytics Settings")
-
-window = st.sidebar.slider("Z-score Window", 10, 200, 50)
-
-z_threshold = st.sidebar.number_input(
-    "Z-score Alert Threshold",
-    value=2.0,
-    step=0.1,
-    min_value=0.5,
-    max_value=5.0
-)
+                st.session_state.thread = threading.Thread(target=run_async_stream, daemon=True)
+                st.session_state.thread.start()
+                st.session_state.streaming = True
+                st.success("Stream started! (May take a few seconds to connect)")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Failed to start stream: {e}")
+                st.info("💡 WebSocket connections may be restricted on Streamlit Cloud. Try running locally for full functionality.")
+
+    with c2:
+        stop_btn = st.button("⏹ Stop", use_container_width=True, key="stop_btn")
+        if stop_btn and st.session_state.streaming:
+            try:
+                stop_stream()
+                st.session_state.streaming = False
+                st.success("Stream stopped!")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error stopping stream: {e}")
+
+    st.sidebar.markdown("### 📊 Analytics Settings")
+
+    price_source = st.sidebar.selectbox(
+        "Price Source",
+        AVAILABLE_PRICE_SOURCES,
+        format_func=str.capitalize,
+        help="Bar closes used for the spread and Z-score; mid and microprice need quote ingestion"
+    )
 
-st.sidebar.markdown("### 📊 Status")
+    window = st.sidebar.slider("Z-score Window", 10, 200, 50)
 
-# Show streaming status
-if st.session_state.streaming:
-    st.sidebar.success("🟢 Stream is LIVE")
-else:
-    st.sidebar.info("🔴 Stream is STOPPED")
+    z_threshold = st.sidebar.number_input(
+        "Z-score Alert Threshold",
+        value=2.0,
+        step=0.1,
+        min_value=0.5,
+        max_value=5.0
+    )
 
-tick_count = get_tick_count()
-st.sidebar.metric("Total Ticks Stored", f"{tick_count:,}")
+    st.sidebar.markdown("### 📊 Status")
 
-st.sidebar.markdown("### 🗄️ Data Management")
+    # Show streaming status
+    if st.session_state.streaming:
+        st.sidebar.success("🟢 Stream is LIVE")
+    else:
+        st.sidebar.info("🔴 Stream is STOPPED")
 
-if st.sidebar.button("🧹 Cleanup Old Data", use_container_width=True):
-    cleanup_old_data(keep_last_n=50000)
-    st.sidebar.success("Data cleaned up!")
-    st.rerun()
+    tick_count = get_tick_count()
+    st.sidebar.metric("Total Ticks Stored", f"{tick_count:,}")
 
-if st.sidebar.button("🗑️ Clear All Data", use_container_width=True):
-    clear_all_data()
-    st.sidebar.success("All data cleared!")
-    st.rerun()
+    ingest_stats = get_ingestion_stats()
+    if ingest_stats["rows"]:
+        st.sidebar.metric(
+            "Write Compression",
+            f"{ingest_stats['compression']:.1f}×",
+            help="Raw exchange trades per stored row"
+        )
+        st.sidebar.caption(
+            f"{ingest_stats['trades']:,} trades → {ingest_stats['rows']:,} rows "
+            f"({ingest_stats['write_saving']:.0%} fewer writes)"
+        )
+    if ingest_stats["quotes"]:
+        st.sidebar.caption(
+            f"{ingest_stats['quotes']:,} quotes → {ingest_stats['quote_rows']:,} quote rows"
+        )
+    if ingest_stats["duplicates"] or ingest_stats["gaps"]:
+        st.sidebar.caption(
+            f"{ingest_stats['duplicates']:,} duplicate messages dropped · "
+            f"{ingest_stats['gaps']:,} gaps ({ingest_stats['missing']:,} trades missing)"
+        )
 
-# ================= AUTO-REFRESH =================
-if st.session_state.streaming:
-    import time
-    time.sleep(2)
-    st.rerun()
+    st.sidebar.markdown("### 🗄️ Data Management")
 
-# ================= LOAD DATA =================
-rows = get_all_ticks()
-if not rows:
-    st.info("⏳ No data available. Click 'Start Stream' to begin ingestion.")
-    st.info("📝 **Note**: WebSocket streaming may be limited on Streamlit Cloud. For full functionality, run locally.")
-    
-    # Create sample data for demo purposes
-    import numpy as np
-    from datetime import datetime, timedelta
-    
-    sample_data = []
-    base_time = datetime.now()
-    for i in range(100):
-        for symbol in ["btcusdt", "ethusdt"]:
-            price = 50000 + np.random.normal(0, 100) if symbol == "btcusdt" else 3000 + np.random.normal(0, 50)
-            qty = np.random.uniform(0.01, 1.0)
-            ts = (base_time - timedelta(seconds=100-i)).isoformat()
-            sample_data.append((ts, symbol, price, qty))
-    
-    df = prepare_df(sample_data)
-    st.warning("📊 Showing sample data for demonstration. Start streaming for live data.")
-else:
-    try:
-        df = prepare_df(rows)
-    except Exception as e:
-        st.error(f"Error preparing data: {e}")
-        st.stop()
+    if st.sidebar.button("🧹 Cleanup Old Data", use_container_width=True):
+        cleanup_old_data(keep_last_n=50000)
+        st.sidebar.success("Data cleaned up!")
+        st.rerun()
+
+    if st.sidebar.button("🗑️ Clear All Data", use_container_width=True):
+        clear_all_data()
+        st.sidebar.success("All data cleared!")
+        st.rerun()
+
+    st.sidebar.markdown("### 🐞 Debug")
+
+    if st.sidebar.button("📸 Profile Next Rerun", use_container_width=True):
+        st.session_state.profile_next_run = True
+        st.rerun()
 
-# ================= KPI ROW =================
-k1, k2, k3 = st.columns(3)
-k1.metric("Total Ticks", f"{len(df):,}")
-k2.metric("Symbols", df["symbol"].nunique())
-k3.metric("Timeframe", timeframe)
-
-st.divider()
-
-# ================= CORE COMPUTATION =================
-resampled = []
-for sym in symbols:
-    sym_df = df[df["symbol"] == sym][["timestamp", "price", "qty"]]
-    bars = resample_ohlc(sym_df, timeframe)
-    bars["symbol"] = sym
-    resampled.append(bars)
-
-price_bars = pd.concat(resampled)
-
-price_chart_df = (
-    price_bars
-    .pivot_table(
-        index="timestamp",
-        columns="symbol",
-        values="close",
-        aggfunc="last"
+    # ================= ANALYTICS SNAPSHOT =================
+    params = AnalyticsParams(
+        symbols=tuple(symbols),
+        timeframe=timeframe,
+        bar_threshold=bar_threshold,
+        window=window,
+        lookback=LOOKBACK_OPTIONS[lookback],
+        price_source=price_source
     )
-    .sort_index()
-)
 
-spread = zs = hedge = rolling_corr = None
+    run_context.update(symbols=symbols, timeframe=timeframe)
 
-if len(symbols) >= 2:
-    s1, s2 = symbols[:2]
+    worker = st.session_state.get("worker")
+    if worker is None or not worker.alive:
+        worker = st.session_state.worker = AnalyticsWorker(params)
+    worker.configure(params)
 
-    df1 = df[df["symbol"] == s1].sort_values("timestamp")
-    df2 = df[df["symbol"] == s2].sort_values("timestamp")
+    with stage("app.snapshot_wait"):
+        snapshot = worker.latest(timeout=WORKER_WAIT)
 
-    n = min(len(df1), len(df2))
-    df1, df2 = df1.iloc[-n:], df2.iloc[-n:]
+    error = worker.error(params)
+    if snapshot is None:
+        if error is not None:
+            st.error(f"Error computing analytics: {error}")
+        else:
+            st.info("⏳ Computing analytics...")
+        st.stop()
 
-    spread, hedge = spread_and_hedge(df1, df2)
-    zs = zscore(spread, window)
+    if snapshot.demo:
+        st.info("⏳ No data available. Click 'Start Stream' to begin ingestion.")
+        st.info("📝 **Note**: WebSocket streaming may be limited on Streamlit Cloud. For full functionality, run locally.")
+        st.warning("📊 Showing sample data for demonstration. Start streaming for live data.")
 
-    corr_df = price_chart_df[[s1, s2]].dropna()
-    if len(corr_df) >= window:
-        rolling_corr = rolling_correlation(
-            corr_df[s1], corr_df[s2], window
+    if snapshot.quotes_missing:
+        st.warning(
+            f"No quotes stored for the {snapshot.params.price_source} price source; "
+            "using trade prices. Enable 'Ingest Quotes' and restart the stream."
         )
 
-# ================= TABS =================
-tab1, tab2, tab3, tab4 = st.tabs(
-    ["📈 Prices", "📊 Analytics", "🧪 Tests", "📥 Export"]
-)
+    if error is not None:
+        st.error(f"Error computing analytics: {error}. Showing the last successful result.")
+    elif snapshot.params != params:
+        st.caption("⏳ Recomputing for the new settings, showing the previous result")
+
+    run_context.update(ticks=snapshot.tick_count, snapshot_version=snapshot.version)
+    price_bars = snapshot.price_bars
+    price_chart_df = snapshot.price_chart_df
+    spread, zs, hedge, rolling_corr = snapshot.spread, snapshot.zs, snapshot.hedge, snapshot.rolling_corr
+    # Labels follow the settings the snapshot was computed for, which lag
+    # the widgets while a recompute is pending
+    shown = snapshot.params
+
+    # ================= KPI ROW =================
+    k1, k2, k3, k4, k5 = st.columns(5)
+    k1.metric("Total Ticks", f"{snapshot.tick_count:,}")
+    k2.metric("Symbols", snapshot.symbol_count)
+    k3.metric("Timeframe", shown.timeframe)
+    k4.metric("Snapshot Age", f"{snapshot.age:.1f} s", help=f"Snapshot v{snapshot.version}")
+    k5.metric("Compute Time", f"{snapshot.compute_ms:.0f} ms")
+
+    st.divider()
+
+    # ================= TABS =================
+    render_start = time.perf_counter()
+    tab1, tab2, tab3, tab4 = st.tabs(
+        ["📈 Prices", "📊 Analytics", "🧪 Tests", "📥 Export"]
+    )
 
-# ---------- TAB 1 ----------
-with tab1:
-    st.line_chart(price_chart_df.tail(400), height=380)
+    # ---------- TAB 1 ----------
+    with tab1:
+        st.line_chart(price_chart_df.tail(400), height=380)
 
-# ---------- TAB 2 (ANALYTICS – CORRELATION INCLUDED) ----------
-with tab2:
-    if spread is None:
-        st.info("📊 Select at least two symbols to view analytics")
-    else:
-        # Metrics row
-        m1, m2, m3 = st.columns(3)
-        m1.metric("Hedge Ratio (β)", f"{hedge:.4f}")
-        if not zs.dropna().empty:
-            latest_z = zs.dropna().iloc[-1]
-            m2.metric("Current Z-score", f"{latest_z:.3f}")
-            m3.metric("Z-score Status", 
-                     "⚠️ Alert" if abs(latest_z) >= z_threshold else "✅ Normal")
+    # ---------- TAB 2 (ANALYTICS – CORRELATION INCLUDED) ----------
+    with tab2:
+        if spread is None:
+            st.info("📊 Select at least two symbols to view analytics")
+        else:
+            # Metrics row
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Hedge Ratio (β)", f"{hedge:.4f}")
+            if not zs.dropna().empty:
+                latest_z = zs.dropna().iloc[-1]
+                m2.metric("Current Z-score", f"{latest_z:.3f}")
+                m3.metric("Z-score Status", 
+                         "⚠️ Alert" if abs(latest_z) >= z_threshold else "✅ Normal")
         
-        st.divider()
+            st.divider()
         
-        # Charts
-        cA, cB = st.columns(2)
-        with cA:
-            st.subheader("📈 Spread")
-            st.line_chart(spread.tail(400), height=280)
-            st.caption(f"Spread = {symbols[0]} - {hedge:.4f} × {symbols[1]}")
-
-        with cB:
-            st.subheader("📊 Z-score")
-            st.line_chart(zs.tail(400), height=280)
-            st.caption(f"Window: {window} | Threshold: ±{z_threshold}")
-
-        st.subheader("🔗 Rolling Correlation")
-        if rolling_corr is not None:
-            st.line_chart(rolling_corr.tail(400), height=280)
-            if not rolling_corr.dropna().empty:
-                latest_corr = rolling_corr.dropna().iloc[-1]
-                st.caption(f"Current correlation: {latest_corr:.4f} | Window: {window}")
-        else:
-            st.info("Collecting more data for correlation analysis...")
-
-# ---------- TAB 3 ----------
-with tab3:
-    if spread is not None:
-        col_a, col_b = st.columns(2)
-        with col_a:
-            if st.button("Run ADF Test", use_container_width=True):
-                try:
-                    p = adf_test(spread)
-                    if p is not None:
-                        st.metric("ADF p-value", f"{p:.6f}")
-                        if p < 0.05:
-                            st.success("✅ Series is stationary (p < 0.05)")
-                        else:
-                            st.warning("⚠️ Series is non-stationary (p ≥ 0.05)")
+            # Charts
+            cA, cB = st.columns(2)
+            with cA:
+                st.subheader("📈 Spread")
+                st.line_chart(spread.tail(400), height=280)
+                st.caption(f"Spread = {shown.symbols[0]} - {hedge:.4f} × {shown.symbols[1]}")
+
+            with cB:
+                st.subheader("📊 Z-score")
+                st.line_chart(zs.tail(400), height=280)
+                st.caption(f"Window: {shown.window} | Threshold: ±{z_threshold}")
+
+            st.subheader("🔗 Rolling Correlation")
+            if rolling_corr is not None:
+                st.line_chart(rolling_corr.tail(400), height=280)
+                if not rolling_corr.dropna().empty:
+                    latest_corr = rolling_corr.dropna().iloc[-1]
+                    st.caption(f"Current correlation: {latest_corr:.4f} | Window: {shown.window}")
+            else:
+                st.info("Collecting more data for correlation analysis...")
+
+    # ---------- TAB 3 ----------
+    with tab3:
+        if spread is not None:
+            col_a, col_b = st.columns(2)
+            with col_a:
+                p = snapshot.adf_pvalue
+                if snapshot.adf_at is None:
+                    st.info("⏳ ADF test running in the background...")
+                elif p is not None:
+                    st.metric("ADF p-value", f"{p:.6f}")
+                    st.caption(f"Computed {time.time() - snapshot.adf_at:.0f} s ago in the background")
+                    if p < 0.05:
+                        st.success("✅ Series is stationary (p < 0.05)")
                     else:
-                        st.error("Insufficient data for ADF test (need at least 20 points)")
-                except Exception as e:
-                    st.error(f"Error running ADF test: {e}")
+                        st.warning("⚠️ Series is non-stationary (p ≥ 0.05)")
+                else:
+                    st.error("Insufficient data for ADF test (need at least 20 points)")
         
-        with col_b:
-            st.markdown("**ADF Test Interpretation:**")
-            st.markdown("- p < 0.05: Reject null hypothesis → Stationary")
-            st.markdown("- p ≥ 0.05: Fail to reject → Non-stationary")
-    else:
-        st.info("Select at least two symbols to run statistical tests")
-
-    if zs is not None and not zs.dropna().empty:
-        latest_z = zs.dropna().iloc[-1]
-        z_val = round(latest_z, 3)
-
-        if abs(z_val) >= z_threshold:
-            st.markdown(
-                f"""
-                <div style="
-                    padding:10px;
-                    border-radius:8px;
-                    background-color:#fee2e2;
-                    color:#991b1b;
-                    font-size:20px;
-                    font-weight:600;
-                ">
-                🚨 Z-score: {z_val} (OUT OF RANGE)
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+            with col_b:
+                st.markdown("**ADF Test Interpretation:**")
+                st.markdown("- p < 0.05: Reject null hypothesis → Stationary")
+                st.markdown("- p ≥ 0.05: Fail to reject → Non-stationary")
         else:
-            st.markdown(
-                f"""
-                <div style="
-                    padding:10px;
-                    border-radius:8px;
-                    background-color:#dcfce7;
-                    color:#166534;
-                    font-size:20px;
-                    font-weight:600;
-                ">
-                ✅ Z-score: {z_val} (NORMAL)
-                </div>
-                """,
-                unsafe_allow_html=True
+            st.info("Select at least two symbols to run statistical tests")
+
+        if zs is not None and not zs.dropna().empty:
+            latest_z = zs.dropna().iloc[-1]
+            z_val = round(latest_z, 3)
+
+            if abs(z_val) >= z_threshold:
+                st.markdown(
+                    f"""
+                    <div style="
+                        padding:10px;
+                        border-radius:8px;
+                        background-color:#fee2e2;
+                        color:#991b1b;
+                        font-size:20px;
+                        font-weight:600;
+                    ">
+                    🚨 Z-score: {z_val} (OUT OF RANGE)
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+            else:
+                st.markdown(
+                    f"""
+                    <div style="
+                        padding:10px;
+                        border-radius:8px;
+                        background-color:#dcfce7;
+                        color:#166534;
+                        font-size:20px;
+                        font-weight:600;
+                    ">
+                    ✅ Z-score: {z_val} (NORMAL)
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+    # ---------- TAB 4 ----------
+    with tab4:
+        price_csv = price_bars.assign(
+            timestamp=price_bars["timestamp"].astype(str)
+        ).to_csv(index=False)
+
+        st.download_button(
+            "Download Price Bars CSV",
+            price_csv,
+            file_name=f"price_bars_{shown.timeframe}.csv",
+            mime="text/csv"
+        )
+
+        gaps = get_gaps()
+        if not gaps.empty:
+            st.download_button(
+                "Download Gap Events CSV",
+                gaps.to_csv(index=False),
+                file_name="gap_events.csv",
+                mime="text/csv"
             )
 
-# ---------- TAB 4 ----------
-with tab4:
-    price_csv = price_bars.assign(
-        timestamp=price_bars["timestamp"].astype(str)
-    ).to_csv(index=False)
-
-    st.download_button(
-        "Download Price Bars CSV",
-        price_csv,
-        file_name=f"price_bars_{timeframe}.csv",
-        mime="text/csv"
-    )
+    record("app.render", time.perf_counter() - render_start)
+finally:
+    # Also runs when st.stop() or st.rerun() ends the script early, so a
+    # requested capture is always stopped and dumped
+    if capture is not None:
+        st.session_state.last_profile = finish_capture(capture)
+    rerun_ms = end_run(**run_context)
+
+# ================= PERFORMANCE =================
+with st.expander("🐞 Performance", expanded=False):
+    st.caption(f"Last rerun: {rerun_ms:.1f} ms (rolling stats over recent reruns)")
+    st.dataframe(stage_summary(), use_container_width=True, hide_index=True)
+    if "last_profile" in st.session_state:
+        profile_path, profile_report = st.session_state.last_profile
+        st.caption(f"cProfile dump: {profile_path} (open with `python -m pstats`)")
+        st.caption(
+            "The dump covers the script thread only; analytics worker stages "
+            "appear in the rolling stats above"
+        )
+        st.code(profile_report)
+
+# ================= AUTO-REFRESH =================
+if st.session_state.streaming:
+    time.sleep(2)
+    st.rerun()
@@ -8,6 +8,16 @@ MAX_SYMBOLS = 5
 WEBSOCKET_TIMEOUT = 30
 WEBSOCKET_PING_INTERVAL = 20
 MAX_RETRIES = 5
+STREAM_MODE = "aggTrade"  # "trade" or "aggTrade"
+AVAILABLE_STREAM_MODES = ["aggTrade", "trade"]
+COALESCE_QUANTUM_MS = 0  # merge ticks within this many ms before storage, 0 = off
+AVAILABLE_COALESCE_QUANTA = [0, 100, 250, 500, 1000]
+QUOTE_INTERVAL_MS = 100  # keep the last bookTicker quote per interval, 0 = every update
+QUOTE_FLUSH_INTERVAL = 1.0  # seconds of quotes buffered per batch write
+TRADE_FLUSH_INTERVAL = 0.25  # seconds of trade rows buffered per batch write
+FEED_CONNECTIONS = 1  # redundant websocket connections per symbol, deduplicated by trade id
+MAX_FEED_CONNECTIONS = 3
+GAP_GRACE_SECONDS = 5.0  # missing trade ids a redundant feed can still deliver before a gap is recorded
 
 # Analytics Settings
 DEFAULT_WINDOW = 50
@@ -15,21 +25,58 @@ MIN_WINDOW = 10
 MAX_WINDOW = 200
 DEFAULT_Z_THRESHOLD = 2.0
 MIN_DATA_POINTS_ADF = 20
+ADF_MAX_LAG = 12  # upper bound for the ADF autolag search
+ADF_MAX_POINTS = 100_000  # ADF runs on at most this many of the latest spread values
+PRICE_SOURCE = "trade"  # bar closes used for the spread: "trade", "mid" or "microprice"
+AVAILABLE_PRICE_SOURCES = ["trade", "mid", "microprice"]
+
+# Synthetic Market Settings
+SYNTHETIC_BASE_PRICES = {"btcusdt": 50000.0, "ethusdt": 3000.0}
+SYNTHETIC_DEFAULT_PRICE = 100.0
+SYNTHETIC_TICK_RATE = 5.0  # trades per second per symbol
+SYNTHETIC_VOLATILITY = 0.6  # annualised GBM volatility of the anchor leg
+SYNTHETIC_HALF_LIFE = 300.0  # seconds, OU spread mean reversion
+SYNTHETIC_SPREAD_VOL = 0.002  # stationary std of the OU spread (log terms)
+SYNTHETIC_MEDIAN_NOTIONAL = 500.0  # median trade size in quote currency
+SYNTHETIC_QUOTE_RATE = 20.0  # top-of-book updates per second per symbol
+SYNTHETIC_SPREAD_BPS = 1.0  # quoted bid/ask spread; trades print on either side
+SYNTHETIC_DEMO_SECONDS = 8 * 3600
+SYNTHETIC_FEED_INTERVAL = 0.25  # seconds between batches of the live feed
+SYNTHETIC_SEED = 42
 
 # Database Settings
 MAX_TICKS_STORED = 100000
 CLEANUP_THRESHOLD = 50000
 DB_TIMEOUT = 10.0
+DB_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file memory-mapped
+DB_CACHE_KB = 64 * 1024  # page cache per connection
+# Bar pyramid levels in seconds; every level must divide the next
+BAR_LEVELS = {"1s": 1, "1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+PYRAMID_BATCH = 50000  # ticks folded into the pyramid per transaction
 
 # UI Settings
 DEFAULT_TIMEFRAME = "1m"
-AVAILABLE_TIMEFRAMES = ["1s", "1m", "5m"]
+AVAILABLE_TIMEFRAMES = ["1s", "1m", "5m", "15m", "1h"]
+# Event-driven bar types and their default thresholds (ticks, qty, notional)
+EVENT_BAR_THRESHOLDS = {"tick": 50, "volume": 1.0, "dollar": 100_000.0}
+EVENT_BAR_MIN_THRESHOLDS = {"tick": 1.0, "volume": 0.001, "dollar": 100.0}
 CHART_HEIGHT = 380
 CHART_TAIL_LIMIT = 400
+LOOKBACK_OPTIONS = {"1h": 3600, "6h": 6 * 3600, "1d": 86400, "1w": 7 * 86400, "All": None}
+DEFAULT_LOOKBACK = "1d"
 
 # Performance Settings
 AUTO_REFRESH_DELAY = 0.5  # seconds
 MAX_DATAFRAME_ROWS = 100000
+WORKER_INTERVAL = 1.0  # seconds between analytics worker data checks
+WORKER_ADF_INTERVAL = 30.0  # min seconds between ADF refreshes on new data with unchanged parameters
+WORKER_IDLE_TIMEOUT = 300.0  # worker exits after this long without a reader
+WORKER_WAIT = 10.0  # max seconds a rerun waits for a snapshot matching its parameters
+PROFILE_WINDOW = 200  # reruns kept per stage for p50/p95
+PROFILE_LOG_PATH = "profile.log"  # one JSON line per rerun
+PROFILE_LOG_MAX_BYTES = 5 * 1024 * 1024  # profile.log is rotated at this size
+PROFILE_LOG_BACKUPS = 2  # rotated profile logs kept (profile.log.1, .2)
+PROFILE_DIR = "profiles"  # cProfile dumps of captured reruns
 
 # Deployment Settings
 STREAMLIT_PORT = 8501
@@ -1,57 +1,262 @@
 import asyncio
 import json
-import websockets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from storage import insert_tick
-from config import WEBSOCKET_TIMEOUT, WEBSOCKET_PING_INTERVAL, MAX_RETRIES
+import time
+from storage import insert_ticks, insert_quotes, insert_gaps, close_connections
+from synthetic import SyntheticMarket, to_rows, to_quote_rows
+from config import (
+    WEBSOCKET_TIMEOUT,
+    WEBSOCKET_PING_INTERVAL,
+    MAX_RETRIES,
+    STREAM_MODE,
+    COALESCE_QUANTUM_MS,
+    QUOTE_INTERVAL_MS,
+    QUOTE_FLUSH_INTERVAL,
+    TRADE_FLUSH_INTERVAL,
+    FEED_CONNECTIONS,
+    GAP_GRACE_SECONDS,
+    SYNTHETIC_TICK_RATE,
+    SYNTHETIC_FEED_INTERVAL,
+)
 
 _running = False
 _tasks = []
+# Batch writes run on one thread per stream, which closes its database
+# connection when the stream ends
+_writer = None
+_stats = {}
+_quote_stats = {"messages": 0, "rows": 0}
+
+class TickCoalescer:
+    """
+    Merges ticks of one symbol that fall into the same time quantum into a
+    single row: last price, summed qty, VWAP, trade count and the last
+    trade id. A quantum of 0 disables coalescing and passes every tick
+    straight through.
+    """
+
+    def __init__(self, symbol, quantum_ms=COALESCE_QUANTUM_MS):
+        self.symbol = symbol
+        self.quantum_ms = int(quantum_ms)
+        self._bucket = None
+
+    def add(self, ts_ms, price, qty, trades=1, trade_id=None):
+        """Add a tick; returns the finished row when the tick closes a bucket"""
+        if not self.quantum_ms:
+            return (_iso(ts_ms), self.symbol, price, qty, price, trades, trade_id)
+
+        bucket = ts_ms // self.quantum_ms
+        row = None
+        if self._bucket is not None and bucket != self._bucket:
+            row = self.flush()
+        if self._bucket is None:
+            self._bucket = bucket
+            self._qty = self._notional = 0.0
+            self._trades = 0
+        self._ts, self._price, self._trade_id = ts_ms, price, trade_id
+        self._qty += qty
+        self._notional += price * qty
+        self._trades += trades
+        return row
+
+    def flush(self):
+        """Emit the open bucket, if any"""
+        if self._bucket is None:
+            return None
+        vwap = self._notional / self._qty if self._qty else self._price
+        row = (
+            _iso(self._ts), self.symbol, self._price, self._qty, vwap, self._trades, self._trade_id
+        )
+        self._bucket = None
+        return row
+
+    def flush_stale(self, now_ms):
+        """Emit the open bucket once its quantum has passed on the wall clock"""
+        if self._bucket is not None and now_ms >= (self._bucket + 1) * self.quantum_ms:
+            return self.flush()
+        return None
+
+class QuoteCoalescer:
+    """
+    Keeps the last top-of-book quote of one symbol per interval. Rows are
+    quote-store rows keyed by the interval start; an interval of 0 keeps
+    every update.
+    """
+
+    def __init__(self, symbol, interval_ms=QUOTE_INTERVAL_MS):
+        self.symbol = symbol
+        self.interval_ms = int(interval_ms)
+        self._row = None
+
+    def add(self, ts_ms, update_id, bid, bid_qty, ask, ask_qty):
+        """Add a quote; returns the finished row when the quote opens a new interval"""
+        bucket = ts_ms // self.interval_ms * self.interval_ms if self.interval_ms else ts_ms
+        row = None
+        if self._row is not None and bucket != self._row[1]:
+            row = self._row
+        self._row = (self.symbol, bucket, ts_ms, update_id, bid, bid_qty, ask, ask_qty)
+        return row
+
+    def flush(self):
+        """Emit the open interval, if any"""
+        row, self._row = self._row, None
+        return row
+
+    def flush_stale(self, now_ms):
+        """Emit the open interval once it has passed on the wall clock"""
+        if self._row is not None and now_ms >= self._row[1] + max(self.interval_ms, 1):
+            return self.flush()
+        return None
+
+class SequenceTracker:
+    """
+    Exchange trade id sequence of one symbol, shared by every connection
+    streaming it. Each message covers a range of trade ids; in the usual
+    in-order case check() is a single comparison. Ids skipped over open a
+    gap that a redundant connection may still fill; gaps left open for
+    GAP_GRACE_SECONDS are handed out by expired().
+    """
+    NEW, LATE, DUPLICATE = "new", "late", "duplicate"
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.last_id = None
+        self._gaps = []  # [first_id, last_id, detected_at], oldest first
+
+    def check(self, first_id, last_id, now):
+        """
+        Classify a message covering trade ids first_id..last_id; returns the
+        status and the number of ids in it not delivered before
+        """
+        if self.last_id is None or first_id == self.last_id + 1:
+            self.last_id = last_id
+            return self.NEW, last_id - first_id + 1
+        if first_id > self.last_id + 1:
+            self._gaps.append([self.last_id + 1, first_id - 1, now])
+            self.last_id = last_id
+            return self.NEW, last_id - first_id + 1
+        if last_id > self.last_id:
+            # Overlaps the ids seen so far: only the part past them and any
+            # gaps it closes are new
+            new = last_id - self.last_id + self._fill(first_id, self.last_id)
+            self.last_id = last_id
+            return self.NEW, new
+        filled = self._fill(first_id, last_id)
+        if filled:
+            return self.LATE, filled
+        return self.DUPLICATE, 0
+
+    def _fill(self, first_id, last_id):
+        """Close the parts of open gaps inside first_id..last_id; returns the ids filled"""
+        filled = 0
+        gaps = []
+        for start, end, detected_at in self._gaps:
+            if first_id <= end and last_id >= start:
+                filled += min(end, last_id) - max(start, first_id) + 1
+                if start < first_id:
+                    gaps.append([start, first_id - 1, detected_at])
+                if last_id < end:
+                    gaps.append([last_id + 1, end, detected_at])
+            else:
+                gaps.append([start, end, detected_at])
+        self._gaps = gaps
+        return filled
+
+    def expired(self, now, grace=GAP_GRACE_SECONDS):
+        """Remove and return the (first_id, last_id) gaps open for `grace` seconds"""
+        gaps = []
+        while self._gaps and now - self._gaps[0][2] >= grace:
+            start, end, _ = self._gaps.pop(0)
+            gaps.append((start, end))
+        return gaps
+
+async def _in_writer(func, *args):
+    """Run a blocking write on the stream's writer thread"""
+    return await asyncio.get_running_loop().run_in_executor(_writer, func, *args)
+
+def _iso(ts_ms):
+    return datetime.utcfromtimestamp(ts_ms / 1000).isoformat()
+
+_STAT_KEYS = ("messages", "trades", "rows", "duplicates", "gaps", "missing")
+
+def _record(symbol, **counts):
+    stats = _stats.setdefault(symbol, dict.fromkeys(_STAT_KEYS, 0))
+    for key, n in counts.items():
+        stats[key] += n
+
+def get_ingestion_stats():
+    """
+    Totals across symbols: raw exchange trades, websocket messages and rows
+    written, plus the trades-per-row compression ratio and the share of
+    writes saved versus storing every raw trade; duplicate messages
+    dropped, trade id gaps and the trades missing in them; and the
+    bookTicker messages received and quote rows written.
+    """
+    messages, trades, rows, duplicates, gaps, missing = (
+        sum(s[key] for s in _stats.values()) for key in _STAT_KEYS
+    )
+    return {
+        "trades": trades,
+        "messages": messages,
+        "rows": rows,
+        "duplicates": duplicates,
+        "gaps": gaps,
+        "missing": missing,
+        "compression": trades / rows if rows else 0.0,
+        "write_saving": 1 - rows / trades if trades else 0.0,
+        "quotes": _quote_stats["messages"],
+        "quote_rows": _quote_stats["rows"],
+    }
+
+def reset_ingestion_stats():
+    _stats.clear()
+    _quote_stats.update(messages=0, rows=0)
+
+async def _run_websocket(name, url, handle, idle):
+    """
+    Receive from `url` until stopped, awaiting handle(message) for every
+    decoded message and idle() whenever the socket is quiet for 5s.
+    Reconnects with exponential backoff, up to MAX_RETRIES in a row.
+    """
+    import websockets
 
-async def _listen_symbol(symbol):
-    url = f"wss://fstream.binance.com/ws/{symbol}@trade"
     retry_count = 0
     max_retries = MAX_RETRIES
     ws = None
     
-    print(f"[{symbol}] Starting WebSocket connection...")
+    print(f"[{name}] Starting WebSocket connection...")
     
     # Check if running in cloud environment
     import os
     is_cloud = os.getenv('STREAMLIT_SHARING_MODE') or os.getenv('STREAMLIT_CLOUD')
     if is_cloud:
-        print(f"[{symbol}] ⚠️ Running in cloud environment - WebSocket may be restricted")
+        print(f"[{name}] ⚠️ Running in cloud environment - WebSocket may be restricted")
     
     try:
         while _running and retry_count < max_retries:
             try:
                 async with websockets.connect(url, ping_interval=WEBSOCKET_PING_INTERVAL, ping_timeout=10) as ws:
-                    print(f"[{symbol}] ✅ Connected successfully!")
+                    print(f"[{name}] ✅ Connected successfully!")
                     retry_count = 0
-                    tick_count = 0
                     
                     while _running:
                         try:
                             msg = await asyncio.wait_for(ws.recv(), timeout=5.0)
-                            data = json.loads(msg)
-                            ts = datetime.utcfromtimestamp(data["T"] / 1000).isoformat()
-                            insert_tick(ts, symbol, float(data["p"]), float(data["q"]))
-                            tick_count += 1
-                            
-                            if tick_count % 10 == 0:
-                                print(f"[{symbol}] Received {tick_count} ticks")
+                            await handle(json.loads(msg))
                                 
                         except asyncio.TimeoutError:
+                            await idle()
                             # Check if still running, if not break
                             if not _running:
-                                print(f"[{symbol}] Stop signal received")
+                                print(f"[{name}] Stop signal received")
                                 break
                             continue
                         except asyncio.CancelledError:
-                            print(f"[{symbol}] Task cancelled")
+                            print(f"[{name}] Task cancelled")
                             break
                         except Exception as e:
-                            print(f"[{symbol}] ❌ Error receiving data: {e}")
+                            print(f"[{name}] ❌ Error receiving data: {e}")
                             break
                     
                     # Break out of retry loop if stopped
@@ -59,30 +264,262 @@ async def _listen_symbol(symbol):
                         break
                             
             except asyncio.CancelledError:
-                print(f"[{symbol}] Connection cancelled")
+                print(f"[{name}] Connection cancelled")
                 break
             except Exception as e:
                 retry_count += 1
-                print(f"[{symbol}] ❌ Connection error (attempt {retry_count}/{max_retries}): {e}")
+                print(f"[{name}] ❌ Connection error (attempt {retry_count}/{max_retries}): {e}")
                 if _running and retry_count < max_retries:
                     wait_time = 2 ** retry_count
-                    print(f"[{symbol}] Waiting {wait_time}s before retry...")
+                    print(f"[{name}] Waiting {wait_time}s before retry...")
                     await asyncio.sleep(wait_time)
     except asyncio.CancelledError:
-        print(f"[{symbol}] Task cancelled during execution")
+        print(f"[{name}] Task cancelled during execution")
+
+class SymbolFeed:
+    """
+    Trade state of one symbol shared by all of its connections: the
+    sequence tracker, the coalescer and the write batch. Messages already
+    delivered by another connection are dropped before they reach the
+    coalescer; the unique (symbol, trade_id) index catches the rest.
+    """
+
+    def __init__(self, symbol, stream_mode=STREAM_MODE, quantum_ms=COALESCE_QUANTUM_MS):
+        self.symbol = symbol
+        self.stream_mode = stream_mode
+        self.tracker = SequenceTracker(symbol)
+        self.coalescer = TickCoalescer(symbol, quantum_ms)
+        self.messages = 0
+        self._rows = []
+        self._gaps = []
+        self._last_flush = time.monotonic()
+
+    async def handle(self, data):
+        # aggTrade messages carry the range of raw trade ids they merge
+        if self.stream_mode == "aggTrade":
+            first_id, last_id = data["f"], data["l"]
+        else:
+            first_id = last_id = data["t"]
+        self.messages += 1
+        now = time.time()
+
+        status, trades = self.tracker.check(first_id, last_id, now)
+        if status == SequenceTracker.DUPLICATE:
+            _record(self.symbol, messages=1, duplicates=1)
+        else:
+            price, qty = float(data["p"]), float(data["q"])
+            if status == SequenceTracker.LATE:
+                # Older than the open bucket: stored as a row of its own
+                row = (_iso(data["T"]), self.symbol, price, qty, price, trades, last_id)
+            else:
+                row = self.coalescer.add(data["T"], price, qty, trades, last_id)
+            if row is not None:
+                self._rows.append(row)
+            _record(self.symbol, messages=1, trades=trades)
+
+        if self.messages % 10 == 0:
+            stats = _stats[self.symbol]
+            print(
+                f"[{self.symbol}] Received {self.messages} messages "
+                f"({stats['trades']} trades -> {stats['rows']} rows)"
+            )
+        self._expire_gaps(now)
+        if time.monotonic() - self._last_flush >= TRADE_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def idle(self):
+        row = self.coalescer.flush_stale(time.time() * 1000)
+        if row is not None:
+            self._rows.append(row)
+        self._expire_gaps(time.time())
+        await self.flush()
+
+    def _expire_gaps(self, now, grace=GAP_GRACE_SECONDS):
+        for first_id, last_id in self.tracker.expired(now, grace):
+            missing = last_id - first_id + 1
+            print(f"[{self.symbol}] ⚠️ Gap: {missing} trades missing (ids {first_id}-{last_id})")
+            self._gaps.append((_iso(now * 1000), self.symbol, first_id, last_id, missing))
+            _record(self.symbol, gaps=1, missing=missing)
+
+    def _write(self, rows, gaps):
+        if rows:
+            _record(self.symbol, rows=insert_ticks(rows))
+        if gaps:
+            insert_gaps(gaps)
+
+    async def flush(self):
+        rows, gaps = self._rows, self._gaps
+        self._rows, self._gaps = [], []
+        self._last_flush = time.monotonic()
+        if rows or gaps:
+            await _in_writer(self._write, rows, gaps)
+
+    def close(self):
+        """Write everything pending; gaps still open at the end are final"""
+        row = self.coalescer.flush()
+        if row is not None:
+            self._rows.append(row)
+        self._expire_gaps(time.time(), grace=0)
+        self._write(self._rows, self._gaps)
+        self._rows, self._gaps = [], []
+
+async def _listen_symbol(feed, connection=0):
+    name = feed.symbol if connection == 0 else f"{feed.symbol}#{connection + 1}"
+    url = f"wss://fstream.binance.com/ws/{feed.symbol}@{feed.stream_mode}"
+    try:
+        await _run_websocket(name, url, feed.handle, feed.idle)
     finally:
-        print(f"[{symbol}] Stream ended")
+        print(f"[{name}] Stream ended")
 
-async def start_stream(symbols):
-    global _running, _tasks
+def _write_quotes(rows):
+    _quote_stats["rows"] += len(rows)
+    if rows:
+        insert_quotes(rows)
+
+async def _listen_quotes(symbol, interval_ms=QUOTE_INTERVAL_MS):
+    """
+    Top-of-book quotes from the bookTicker stream. Updates arrive far faster
+    than trades, so they are coalesced to the last quote per interval and
+    written in batches every QUOTE_FLUSH_INTERVAL seconds.
+    """
+    name = f"{symbol}@bookTicker"
+    url = f"wss://fstream.binance.com/ws/{name}"
+    coalescer = QuoteCoalescer(symbol, interval_ms)
+    batch = []
+    last_flush = time.monotonic()
+
+    async def flush():
+        nonlocal batch, last_flush
+        rows, batch = batch, []
+        last_flush = time.monotonic()
+        await _in_writer(_write_quotes, rows)
+
+    async def handle(data):
+        _quote_stats["messages"] += 1
+        row = coalescer.add(
+            data.get("T") or data["E"], data["u"],
+            float(data["b"]), float(data["B"]), float(data["a"]), float(data["A"])
+        )
+        if row is not None:
+            batch.append(row)
+        if time.monotonic() - last_flush >= QUOTE_FLUSH_INTERVAL:
+            await flush()
+
+    async def idle():
+        row = coalescer.flush_stale(time.time() * 1000)
+        if row is not None:
+            batch.append(row)
+        await flush()
+
+    try:
+        await _run_websocket(name, url, handle, idle)
+    finally:
+        row = coalescer.flush()
+        _write_quotes(batch + ([] if row is None else [row]))
+        print(f"[{name}] Stream ended")
+
+def _coalesce_batch(coalescers, batch):
+    """Run a generated batch through per-symbol coalescers, returning finished rows"""
+    rows = []
+    ts_ms = batch["timestamp"].to_numpy().astype("datetime64[ms]").astype("int64")
+    for ts, symbol, price, qty, trade_id in zip(
+        ts_ms.tolist(), batch["symbol"].tolist(), batch["price"].tolist(),
+        batch["qty"].tolist(), batch["trade_id"].tolist()
+    ):
+        row = coalescers[symbol].add(ts, price, qty, 1, trade_id)
+        if row is not None:
+            rows.append(row)
+    now_ms = time.time() * 1000
+    for coalescer in coalescers.values():
+        row = coalescer.flush_stale(now_ms)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+async def _synthetic_feed(
+    symbols, tick_rate=SYNTHETIC_TICK_RATE, quantum_ms=COALESCE_QUANTUM_MS, quotes=False
+):
+    """Paced live feed from the synthetic market (and its quotes), written in batches"""
+    market = SyntheticMarket(symbols, tick_rate=tick_rate)
+    coalescers = {s: TickCoalescer(s, quantum_ms) for s in symbols}
+    tick_count = 0
+    print(f"[synthetic] Generating {tick_rate:g} ticks/s per symbol for {symbols}")
+
+    try:
+        while _running:
+            await asyncio.sleep(SYNTHETIC_FEED_INTERVAL)
+            # Catch up to wall-clock time so the feed keeps pace even if a
+            # batch write runs long
+            batch = market.generate(duration=time.time() - market.clock, quotes=quotes)
+            if quotes:
+                batch, quote_batch = batch
+                # A straddling interval is resolved by update id in the store
+                quote_rows = to_quote_rows(quote_batch, QUOTE_INTERVAL_MS)
+                await _in_writer(_write_quotes, quote_rows)
+                _quote_stats["messages"] += len(quote_batch)
+            if batch.empty:
+                continue
+            rows = _coalesce_batch(coalescers, batch) if quantum_ms else to_rows(batch)
+            await _in_writer(insert_ticks, rows)
+            for symbol, n in batch["symbol"].value_counts().items():
+                _record(symbol, messages=n, trades=n)
+            for row in rows:
+                _record(row[1], rows=1)
+            tick_count += len(batch)
+            if tick_count % 1000 < len(batch):
+                print(f"[synthetic] Generated {tick_count} ticks")
+    except asyncio.CancelledError:
+        print("[synthetic] Task cancelled")
+    finally:
+        rows = [row for row in (c.flush() for c in coalescers.values()) if row is not None]
+        if rows:
+            insert_ticks(rows)
+            for row in rows:
+                _record(row[1], rows=1)
+        print("[synthetic] Stream ended")
+
+async def start_stream(
+    symbols,
+    source="binance",
+    tick_rate=SYNTHETIC_TICK_RATE,
+    stream_mode=STREAM_MODE,
+    quantum_ms=COALESCE_QUANTUM_MS,
+    quotes=False,
+    connections=FEED_CONNECTIONS,
+):
+    """
+    Stream trades for `symbols` until stop_stream(). With `quotes`, top-of-
+    book quotes are ingested alongside into the quote store. Binance
+    trades can be streamed over several redundant `connections` per
+    symbol; each trade is still stored once.
+    """
+    global _running, _tasks, _writer
     _running = True
-    print(f"🚀 Starting stream for symbols: {symbols}")
+    reset_ingestion_stats()
+    _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion-writer")
+    feeds = {}
+    print(f"🚀 Starting {source} stream for symbols: {symbols}")
     try:
-        _tasks = [asyncio.create_task(_listen_symbol(s)) for s in symbols]
+        if source == "synthetic":
+            _tasks = [asyncio.create_task(_synthetic_feed(symbols, tick_rate, quantum_ms, quotes))]
+        else:
+            feeds = {s: SymbolFeed(s, stream_mode, quantum_ms) for s in symbols}
+            _tasks = [
+                asyncio.create_task(_listen_symbol(feeds[s], n))
+                for s in symbols
+                for n in range(connections)
+            ]
+            if quotes:
+                _tasks += [asyncio.create_task(_listen_quotes(s)) for s in symbols]
         await asyncio.gather(*_tasks, return_exceptions=True)
     except Exception as e:
         print(f"❌ Stream error: {e}")
     finally:
+        for feed in feeds.values():
+            feed.close()
+        await _in_writer(close_connections)
+        _writer.shutdown()
+        close_connections()
         print("Stream tasks completed")
         _tasks = []
 
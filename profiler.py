@@ -0,0 +1,127 @@
+"""
+Lightweight stage timing for the dashboard.
+
+Stages are timed with the stage() context manager or the timed()
+decorator. Every sample feeds a rolling window per stage (for p50/p95 in
+the debug panel), and the stages of one script rerun are written as a
+single JSON line to PROFILE_LOG_PATH, rotated at PROFILE_LOG_MAX_BYTES. A
+rerun can also be captured with cProfile and dumped as a pstats file for
+offline inspection.
+"""
+import cProfile
+import io
+import json
+import logging
+import logging.handlers
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+from config import PROFILE_WINDOW, PROFILE_LOG_PATH, PROFILE_LOG_MAX_BYTES, PROFILE_LOG_BACKUPS, PROFILE_DIR
+
+_samples = {}
+_samples_lock = threading.Lock()
+# Each Streamlit rerun executes in its own script thread
+_local = threading.local()
+
+logger = logging.getLogger("gemscap.profile")
+if not logger.handlers:
+    # Reruns every couple of seconds while streaming: rotate so the log stays bounded
+    _handler = logging.handlers.RotatingFileHandler(
+        PROFILE_LOG_PATH, maxBytes=PROFILE_LOG_MAX_BYTES, backupCount=PROFILE_LOG_BACKUPS, delay=True
+    )
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def record(name, seconds):
+    ms = seconds * 1000
+    with _samples_lock:
+        _samples.setdefault(name, deque(maxlen=PROFILE_WINDOW)).append(ms)
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run[name] = run.get(name, 0.0) + ms
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def timed(name):
+    """Decorator timing every call of a function as stage `name`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def begin_run():
+    """Start collecting the stages of the current rerun"""
+    _local.run = {}
+    _local.start = time.perf_counter()
+
+def end_run(**context):
+    """
+    Finish the current rerun: record its total time and write the
+    per-stage breakdown to the structured log. Returns the total in ms.
+    """
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    total = time.perf_counter() - _local.start
+    _local.run = None
+    record("rerun.total", total)
+    logger.info(json.dumps({
+        "ts": datetime.utcnow().isoformat(),
+        "total_ms": round(total * 1000, 3),
+        "stages": {k: round(v, 3) for k, v in run.items()},
+        **context,
+    }))
+    return total * 1000
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def stage_summary():
+    """Rolling stats per stage: calls in window, last, p50 and p95 in ms"""
+    with _samples_lock:
+        snapshot = {k: list(v) for k, v in _samples.items()}
+    return [
+        {
+            "stage": name,
+            "calls": len(values),
+            "last_ms": round(values[-1], 2),
+            "p50_ms": round(_percentile(values, 0.5), 2),
+            "p95_ms": round(_percentile(values, 0.95), 2),
+        }
+        for name, values in snapshot.items()
+    ]
+
+def start_capture():
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+def finish_capture(profile, top=25):
+    """Stop a capture, dump it to PROFILE_DIR and return (path, top functions report)"""
+    profile.disable()
+    out_dir = Path(PROFILE_DIR)
+    out_dir.mkdir(exist_ok=True)
+    path = out_dir / f"rerun-{datetime.utcnow():%Y%m%d-%H%M%S}.pstats"
+    profile.dump_stats(path)
+
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(top)
+    return path, report.getvalue()
@@ -1,88 +1,448 @@
+import json
 import sqlite3
 from pathlib import Path
 import threading
 
+import pandas as pd
+
+from profiler import timed
+from config import BAR_LEVELS, PYRAMID_BATCH, DB_TIMEOUT, DB_MMAP_SIZE, DB_CACHE_KB
+
 DB_PATH = Path("market_data.db")
-_lock = threading.Lock()
+# Serialises writers only: in WAL mode readers work on a snapshot and
+# never wait for the writer
+_write_lock = threading.Lock()
+_local = threading.local()
+# Schema setup runs once per process, not on every dashboard rerun
+_initialised = False
 
-def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False, timeout=10.0)
+_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA mmap_size = {DB_MMAP_SIZE}",
+    f"PRAGMA cache_size = -{DB_CACHE_KB}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+def _open(readonly):
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False, timeout=DB_TIMEOUT
+        )
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=DB_TIMEOUT)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection(readonly=False):
+    """
+    Persistent connection for the calling thread: one read-write and one
+    read-only connection per thread, opened on first use
+    """
+    key = "reader" if readonly else "writer"
+    conn = getattr(_local, key, None)
+    if conn is None:
+        conn = _open(readonly)
+        setattr(_local, key, conn)
+    return conn
+
+def close_connections():
+    """Close the calling thread's connections"""
+    for key in ("reader", "writer"):
+        conn = getattr(_local, key, None)
+        if conn is not None:
+            conn.close()
+            setattr(_local, key, None)
 
 def init_db():
+    global _initialised
+    if _initialised:
+        return
     conn = get_connection()
     cur = conn.cursor()
+    # WAL is persistent in the database file
+    cur.execute("PRAGMA journal_mode = WAL")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS ticks (
             timestamp TEXT,
             symbol TEXT,
             price REAL,
-            qty REAL
+            qty REAL,
+            vwap REAL,
+            trades INTEGER,
+            trade_id INTEGER
         )
     """)
+    # Databases created before tick coalescing lack the vwap/trades columns,
+    # and before trade id tracking the trade_id column
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(ticks)")}
+    if "vwap" not in columns:
+        cur.execute("ALTER TABLE ticks ADD COLUMN vwap REAL")
+    if "trades" not in columns:
+        cur.execute("ALTER TABLE ticks ADD COLUMN trades INTEGER DEFAULT 1")
+    if "trade_id" not in columns:
+        cur.execute("ALTER TABLE ticks ADD COLUMN trade_id INTEGER")
+    # Each exchange trade (the last one of a coalesced row) is stored once,
+    # however many feeds deliver it. Rows without a trade id are exempt:
+    # NULLs never collide in a unique index.
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ticks_symbol_trade_id ON ticks (symbol, trade_id)"
+    )
+    # Gap events: ranges of trade ids no feed delivered
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS gaps (
+            detected_at TEXT,
+            symbol TEXT,
+            first_id INTEGER,
+            last_id INTEGER,
+            missing INTEGER
+        )
+    """)
+    # Bar pyramid: one row per (level seconds, symbol, bucket start epoch),
+    # with the exchange times (epoch us) of the ticks behind open and close
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bars (
+            level INTEGER,
+            symbol TEXT,
+            ts INTEGER,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            trades INTEGER,
+            open_at INTEGER,
+            close_at INTEGER,
+            PRIMARY KEY (level, symbol, ts)
+        ) WITHOUT ROWID
+    """)
+    # Bars built before late-tick handling lack the open/close times: their
+    # open is kept as is and the next tick in the bucket takes the close
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(bars)")}
+    for column in ("open_at", "close_at"):
+        if column not in columns:
+            cur.execute(f"ALTER TABLE bars ADD COLUMN {column} INTEGER")
+    # Quote store: last top-of-book quote per (symbol, interval start epoch ms),
+    # with the exchange time and update id of that quote
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS quotes (
+            symbol TEXT,
+            bucket INTEGER,
+            ts INTEGER,
+            update_id INTEGER,
+            bid REAL,
+            bid_qty REAL,
+            ask REAL,
+            ask_qty REAL,
+            PRIMARY KEY (symbol, bucket)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+    # Tick count is maintained on every write instead of scanning the table;
+    # the table is only counted once, to seed a database that predates it
+    if not cur.execute("SELECT 1 FROM meta WHERE key = 'tick_count'").fetchall():
+        cur.execute("INSERT INTO meta SELECT 'tick_count', COUNT(*) FROM ticks")
     conn.commit()
-    conn.close()
+    _initialised = True
 
-def insert_tick(ts, symbol, price, qty):
-    with _lock:
+# Ticks already stored under the same (symbol, trade_id) are skipped
+_INSERT_SQL = (
+    "INSERT OR IGNORE INTO ticks (timestamp, symbol, price, qty, vwap, trades, trade_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+_COUNT_SQL = "UPDATE meta SET value = value + ? WHERE key = 'tick_count'"
+
+def insert_ticks(rows):
+    """
+    Insert a batch of (timestamp, symbol, price, qty, vwap, trades, trade_id)
+    rows in one transaction, skipping trade ids already stored. Returns the
+    number of rows inserted.
+    """
+    with _write_lock:
         try:
             conn = get_connection()
-            conn.execute(
-                "INSERT INTO ticks VALUES (?, ?, ?, ?)",
-                (ts, symbol, price, qty)
-            )
-            conn.commit()
-            conn.close()
+            with conn:
+                cur = conn.executemany(_INSERT_SQL, rows)
+                conn.execute(_COUNT_SQL, (cur.rowcount,))
+            return cur.rowcount
         except Exception as e:
-            print(f"Error inserting tick: {e}")
+            print(f"Error inserting ticks: {e}")
+            return 0
 
-def get_all_ticks():
-    with _lock:
+def insert_gaps(rows):
+    """Record (detected_at, symbol, first_id, last_id, missing) gap events"""
+    with _write_lock:
         try:
             conn = get_connection()
-            rows = conn.execute("SELECT * FROM ticks ORDER BY timestamp DESC LIMIT 100000").fetchall()
-            conn.close()
-            return rows
+            with conn:
+                conn.executemany("INSERT INTO gaps VALUES (?, ?, ?, ?, ?)", rows)
         except Exception as e:
-            print(f"Error fetching ticks: {e}")
-            return []
+            print(f"Error recording gaps: {e}")
 
-def get_tick_count():
-    with _lock:
+def get_gaps(limit=1000):
+    """Most recent gap events, newest first"""
+    try:
+        conn = get_connection(readonly=True)
+        rows = conn.execute(
+            "SELECT detected_at, symbol, first_id, last_id, missing FROM gaps "
+            "ORDER BY rowid DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    except Exception as e:
+        print(f"Error fetching gaps: {e}")
+        rows = []
+    return pd.DataFrame(rows, columns=["detected_at", "symbol", "first_id", "last_id", "missing"])
+
+def insert_quotes(rows):
+    """
+    Insert a batch of (symbol, bucket, ts, update_id, bid, bid_qty, ask,
+    ask_qty) rows in one transaction. A bucket written by an earlier batch
+    keeps whichever quote has the higher update id.
+    """
+    with _write_lock:
         try:
             conn = get_connection()
-            count = conn.execute("SELECT COUNT(*) FROM ticks").fetchone()[0]
-            conn.close()
-            return count
+            with conn:
+                conn.executemany("""
+                    INSERT INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(symbol, bucket) DO UPDATE SET
+                        ts = excluded.ts,
+                        update_id = excluded.update_id,
+                        bid = excluded.bid,
+                        bid_qty = excluded.bid_qty,
+                        ask = excluded.ask,
+                        ask_qty = excluded.ask_qty
+                    WHERE excluded.update_id >= quotes.update_id
+                """, rows)
         except Exception as e:
-            print(f"Error counting ticks: {e}")
-            return 0
+            print(f"Error inserting quotes: {e}")
+
+@timed("storage.get_quotes_at")
+def get_quotes_at(symbol, times):
+    """
+    The last stored quote of `symbol` at or before each of `times` (epoch
+    ms), one primary-key lookup per time, so the cost tracks the number of
+    times rather than the quotes stored. Returns a frame of timestamp (the
+    requested time), symbol, bid, bid_qty, ask, ask_qty; times before the
+    first quote are left out.
+    """
+    try:
+        conn = get_connection(readonly=True)
+        # CROSS JOIN keeps the requested times as the outer loop
+        rows = conn.execute("""
+            SELECT t.value, q.bid, q.bid_qty, q.ask, q.ask_qty
+            FROM json_each(?) AS t
+            CROSS JOIN quotes AS q ON q.symbol = ? AND q.bucket = (
+                SELECT bucket FROM quotes
+                WHERE symbol = ? AND bucket <= t.value AND ts <= t.value
+                ORDER BY bucket DESC LIMIT 1
+            )
+        """, (json.dumps([int(t) for t in times]), symbol, symbol)).fetchall()
+    except Exception as e:
+        print(f"Error fetching quotes: {e}")
+        rows = []
+
+    quotes = pd.DataFrame(rows, columns=["ts", "bid", "bid_qty", "ask", "ask_qty"])
+    quotes.insert(0, "timestamp", pd.to_datetime(quotes.pop("ts"), unit="ms"))
+    quotes.insert(1, "symbol", symbol)
+    return quotes
+
+@timed("storage.get_all_ticks")
+def get_all_ticks():
+    try:
+        conn = get_connection(readonly=True)
+        return conn.execute("SELECT timestamp, symbol, price, qty FROM ticks ORDER BY timestamp DESC LIMIT 100000").fetchall()
+    except Exception as e:
+        print(f"Error fetching ticks: {e}")
+        return []
 
+@timed("storage.get_tick_count")
+def get_tick_count():
+    try:
+        conn = get_connection(readonly=True)
+        rows = conn.execute("SELECT value FROM meta WHERE key = 'tick_count'").fetchall()
+        return rows[0][0] if rows else 0
+    except Exception as e:
+        print(f"Error counting ticks: {e}")
+        return 0
+
+@timed("storage.cleanup_old_data")
 def cleanup_old_data(keep_last_n=50000):
     """Keep only the most recent N records"""
-    with _lock:
+    with _write_lock:
         try:
             conn = get_connection()
-            count = conn.execute("SELECT COUNT(*) FROM ticks").fetchone()[0]
-            if count > keep_last_n:
-                conn.execute(f"""
-                    DELETE FROM ticks WHERE rowid NOT IN (
-                        SELECT rowid FROM ticks ORDER BY timestamp DESC LIMIT {keep_last_n}
-                    )
-                """)
-                conn.commit()
+            if get_tick_count() > keep_last_n:
+                with conn:
+                    cur = conn.execute(f"""
+                        DELETE FROM ticks WHERE rowid NOT IN (
+                            SELECT rowid FROM ticks ORDER BY timestamp DESC LIMIT {keep_last_n}
+                        )
+                    """)
+                    conn.execute(_COUNT_SQL, (-cur.rowcount,))
                 print(f"Cleaned up old data, kept {keep_last_n} records")
-            conn.close()
         except Exception as e:
             print(f"Error cleaning up data: {e}")
 
+@timed("storage.clear_all_data")
 def clear_all_data():
     """Clear all data from database"""
-    with _lock:
+    with _write_lock:
         try:
             conn = get_connection()
-            conn.execute("DELETE FROM ticks")
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute("DELETE FROM ticks")
+                conn.execute("DELETE FROM bars")
+                conn.execute("DELETE FROM quotes")
+                conn.execute("DELETE FROM gaps")
+                conn.execute("DELETE FROM meta WHERE key = 'bars_rowid'")
+                conn.execute("UPDATE meta SET value = 0 WHERE key = 'tick_count'")
             print("All data cleared")
         except Exception as e:
             print(f"Error clearing data: {e}")
+
+_BAR_COLUMNS = ["open", "high", "low", "close", "volume", "trades"]
+_OHLCV = {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum", "trades": "sum"}
+_TIME_COLUMNS = ["open_at", "close_at"]
+_BAR_SQL = "INTO bars (level, symbol, ts, {}) VALUES ({})".format(
+    ", ".join(_BAR_COLUMNS + _TIME_COLUMNS), ", ".join("?" * (3 + len(_BAR_COLUMNS) + len(_TIME_COLUMNS)))
+)
+
+def timeframe_seconds(timeframe):
+    """'1s', '5m', '1h', '1d' -> seconds"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    return int(timeframe[:-1]) * units[timeframe[-1]]
+
+def _records(bars):
+    """Rows in bars-table column order as native Python values"""
+    columns = ["level", "symbol", "ts"] + _BAR_COLUMNS + _TIME_COLUMNS
+    return list(zip(*(bars[c].astype(object).where(bars[c].notna(), None).tolist() for c in columns)))
+
+def _roll_up(conn, level, parent, keys):
+    """
+    Recompute the `level` buckets covering the changed `parent` buckets
+    from the parent level, and return the changed (symbol, ts) keys
+    """
+    changed = keys.assign(ts=keys["ts"] // level * level).drop_duplicates()
+    for symbol, group in changed.groupby("symbol"):
+        rows = conn.execute(
+            "SELECT ts, open, high, low, close, volume, trades, open_at, close_at FROM bars "
+            "WHERE level = ? AND symbol = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (parent, symbol, int(group["ts"].min()), int(group["ts"].max()) + level)
+        ).fetchall()
+        bars = pd.DataFrame(rows, columns=["ts"] + _BAR_COLUMNS + _TIME_COLUMNS)
+        bars = (
+            bars.groupby(bars["ts"] // level * level)
+            .agg({**_OHLCV, "open_at": "min", "close_at": "max"})
+            .reset_index()
+        )
+        conn.executemany(
+            "INSERT OR REPLACE " + _BAR_SQL,
+            _records(bars.assign(level=level, symbol=symbol))
+        )
+    return changed
+
+@timed("storage.update_bar_pyramid")
+def update_bar_pyramid():
+    """
+    Fold ticks inserted since the last call into the 1s base bars and roll
+    the touched buckets up through every coarser level. Work is
+    proportional to the new ticks. Returns the number of ticks folded in.
+    """
+    levels = sorted(BAR_LEVELS.values())
+    total = 0
+    try:
+        conn = get_connection()
+        while True:
+            # One batch per write transaction so ingestion is not held up
+            # for a whole backfill
+            with _write_lock, conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'bars_rowid'").fetchall()
+                watermark = row[0][0] if row else 0
+                rows = conn.execute(
+                    "SELECT rowid, timestamp, symbol, price, qty, COALESCE(trades, 1) FROM ticks "
+                    "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (watermark, PYRAMID_BATCH)
+                ).fetchall()
+                if not rows:
+                    break
+
+                ticks = pd.DataFrame(rows, columns=["rowid", "timestamp", "symbol", "price", "qty", "trades"])
+                ticks["timestamp"] = pd.to_datetime(ticks["timestamp"], format="mixed", errors="coerce")
+                ticks = ticks.dropna(subset=["timestamp"])
+                ticks["ts"] = (ticks["timestamp"] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+                ticks["at"] = (ticks["timestamp"] - pd.Timestamp(0)) // pd.Timedelta(microseconds=1)
+                ticks = ticks.sort_values(["symbol", "ts", "timestamp", "rowid"], kind="stable")
+                base = (
+                    ticks.groupby(["symbol", "ts"])
+                    .agg(open=("price", "first"), high=("price", "max"), low=("price", "min"),
+                         close=("price", "last"), volume=("qty", "sum"), trades=("trades", "sum"),
+                         open_at=("at", "first"), close_at=("at", "last"))
+                    .reset_index()
+                )
+
+                # A 1s bucket can straddle two batches, and a gap fill can land
+                # in a later batch than the ticks around it: merge into the
+                # stored bar, taking open and close by exchange time. On equal
+                # times the later insert wins the close, as it would in a batch.
+                conn.executemany("INSERT " + _BAR_SQL + """
+                    ON CONFLICT(level, symbol, ts) DO UPDATE SET
+                        open = CASE WHEN excluded.open_at < open_at THEN excluded.open ELSE open END,
+                        high = max(high, excluded.high),
+                        low = min(low, excluded.low),
+                        close = CASE WHEN excluded.close_at >= COALESCE(close_at, excluded.close_at)
+                                THEN excluded.close ELSE close END,
+                        volume = volume + excluded.volume,
+                        trades = trades + excluded.trades,
+                        open_at = min(open_at, excluded.open_at),
+                        close_at = COALESCE(max(close_at, excluded.close_at), excluded.close_at)
+                """, _records(base.assign(level=levels[0])))
+
+                keys = base[["symbol", "ts"]]
+                for parent, level in zip(levels, levels[1:]):
+                    keys = _roll_up(conn, level, parent, keys)
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('bars_rowid', ?)", (int(rows[-1][0]),)
+                )
+            total += len(rows)
+    except Exception as e:
+        print(f"Error updating bar pyramid: {e}")
+    return total
+
+@timed("storage.get_bars")
+def get_bars(symbols, timeframe, start=None, end=None):
+    """
+    OHLCV bars for `symbols` at `timeframe` between `start` and `end`
+    (epoch seconds, end exclusive). Reads the coarsest pyramid level that
+    divides the timeframe and only rolls up further when the timeframe is
+    not a level itself, so the cost tracks the number of bars returned.
+    """
+    seconds = timeframe_seconds(timeframe)
+    level = max(l for l in BAR_LEVELS.values() if seconds % l == 0)
+    start = 0 if start is None else int(start) // seconds * seconds
+    end = 2 ** 62 if end is None else int(end)
+    placeholders = ", ".join("?" * len(symbols))
+
+    try:
+        conn = get_connection(readonly=True)
+        rows = conn.execute(
+            f"SELECT symbol, ts, open, high, low, close, volume, trades FROM bars "
+            f"WHERE level = ? AND symbol IN ({placeholders}) AND ts >= ? AND ts < ? "
+            f"ORDER BY symbol, ts",
+            (level, *symbols, start, end)
+        ).fetchall()
+    except Exception as e:
+        print(f"Error fetching bars: {e}")
+        rows = []
+
+    bars = pd.DataFrame(rows, columns=["symbol", "ts"] + _BAR_COLUMNS)
+    if level != seconds:
+        bars = (
+            bars.groupby(["symbol", bars["ts"] // seconds * seconds])
+            .agg(_OHLCV)
+            .reset_index()
+        )
+    bars["timestamp"] = pd.to_datetime(bars["ts"], unit="s")
+    return bars[["timestamp", "open", "high", "low", "close", "volume", "symbol"]]
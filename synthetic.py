@@ -0,0 +1,262 @@
+"""
+Synthetic cointegrated market generator.
+
+The first symbol is the anchor leg and follows a GBM. Every other leg
+tracks the anchor in log space with a beta loading plus its own
+Ornstein-Uhlenbeck spread, so all legs are correlated GBMs and each pair
+with the anchor is cointegrated. Trades arrive as a Poisson process per
+symbol and trade sizes are lognormal in notional terms. The latent price
+is the mid: trades print at the bid or the ask, and top-of-book quotes
+can be generated on the same paths.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    SYNTHETIC_BASE_PRICES,
+    SYNTHETIC_DEFAULT_PRICE,
+    SYNTHETIC_TICK_RATE,
+    SYNTHETIC_VOLATILITY,
+    SYNTHETIC_HALF_LIFE,
+    SYNTHETIC_SPREAD_VOL,
+    SYNTHETIC_MEDIAN_NOTIONAL,
+    SYNTHETIC_QUOTE_RATE,
+    SYNTHETIC_SPREAD_BPS,
+)
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+# Largest decay exponent summed inside one OU block before rebasing
+_OU_BLOCK = 20.0
+
+
+def _ou_path(times, x0, theta, sigma, last_time, rng):
+    """
+    Exact OU discretisation on irregular event times.
+
+    x_k = a_k x_{k-1} + b_k e_k is solved with cumulative sums in blocks
+    where the accumulated decay stays bounded, so it is vectorised without
+    overflowing exp().
+    """
+    n = len(times)
+    if n == 0:
+        return np.empty(0), x0
+
+    dt = np.diff(times, prepend=last_time)
+    decay = np.exp(-theta * dt)
+    noise = sigma * np.sqrt((1.0 - decay ** 2) / (2.0 * theta)) * rng.standard_normal(n)
+
+    # L is the cumulative decay exponent, relative to the previous state
+    L = theta * (times - last_time)
+    out = np.empty(n)
+    carry = x0
+    carry_L = 0.0
+    bounds = np.flatnonzero(np.diff(np.floor(L / _OU_BLOCK))) + 1
+    for block in np.split(np.arange(n), bounds):
+        Lb = L[block]
+        rel = Lb - Lb[0]
+        acc = np.cumsum(noise[block] * np.exp(rel))
+        out[block] = carry * np.exp(-(Lb - carry_L)) + acc * np.exp(-rel)
+        carry = out[block[-1]]
+        carry_L = Lb[-1]
+
+    return out, carry
+
+
+class SyntheticMarket:
+    """
+    Stateful tick generator. Successive calls to generate() continue the
+    same price paths and clock, so it can back both a one-shot demo sample
+    and a paced live feed.
+    """
+
+    def __init__(
+        self,
+        symbols,
+        base_prices=None,
+        tick_rate=SYNTHETIC_TICK_RATE,
+        volatility=SYNTHETIC_VOLATILITY,
+        betas=None,
+        half_life=SYNTHETIC_HALF_LIFE,
+        spread_vol=SYNTHETIC_SPREAD_VOL,
+        median_notional=SYNTHETIC_MEDIAN_NOTIONAL,
+        quote_rate=SYNTHETIC_QUOTE_RATE,
+        spread_bps=SYNTHETIC_SPREAD_BPS,
+        start=None,
+        seed=None,
+    ):
+        if not symbols:
+            raise ValueError("At least one symbol is required")
+
+        base_prices = {**SYNTHETIC_BASE_PRICES, **(base_prices or {})}
+        self.symbols = list(symbols)
+        self.base = np.array(
+            [base_prices.get(s, SYNTHETIC_DEFAULT_PRICE) for s in self.symbols],
+            dtype=float,
+        )
+        self.betas = np.ones(len(self.symbols)) if betas is None else np.asarray(betas, dtype=float)
+        self.tick_rate = float(tick_rate)
+        self.sigma = volatility / np.sqrt(SECONDS_PER_YEAR)
+        self.theta = np.log(2) / half_life
+        self.ou_sigma = spread_vol * np.sqrt(2 * self.theta)
+        self.median_notional = median_notional
+        self.quote_rate = float(quote_rate)
+        self.half_spread = spread_bps / 2e4
+        self.rng = np.random.default_rng(seed)
+
+        self.clock = time.time() if start is None else float(start)
+        self._anchor = 0.0  # log return of the anchor leg since start
+        self._ou = np.zeros(len(self.symbols))
+        self._ou_time = np.full(len(self.symbols), self.clock)
+        self._update_id = 0
+        # Trade ids start from the clock in microseconds so they keep
+        # increasing across markets, like exchange trade ids
+        self._trade_id = np.full(len(self.symbols), int(self.clock * 1e6), dtype=np.int64)
+
+    def _arrivals(self, n_ticks, duration):
+        total_rate = self.tick_rate * len(self.symbols)
+        if duration is not None:
+            n = self.rng.poisson(total_rate * duration)
+            times = self.clock + np.sort(self.rng.uniform(0.0, duration, n))
+            end = self.clock + duration
+        else:
+            times = self.clock + np.cumsum(self.rng.exponential(1.0 / total_rate, n_ticks))
+            end = times[-1] if n_ticks else self.clock
+        # Equal per-symbol rates: splitting a merged Poisson process uniformly
+        # yields independent Poisson arrivals per symbol
+        codes = self.rng.integers(0, len(self.symbols), len(times))
+        return times, codes, end
+
+    def _quote_arrivals(self, end):
+        n = self.rng.poisson(self.quote_rate * len(self.symbols) * (end - self.clock))
+        times = self.clock + np.sort(self.rng.uniform(0.0, end - self.clock, n))
+        return times, self.rng.integers(0, len(self.symbols), n)
+
+    def generate(self, n_ticks=None, duration=None, quotes=False):
+        """
+        Generate the next batch of trades, either a fixed number of ticks or
+        all ticks arriving within `duration` seconds.
+
+        Returns a DataFrame with the same columns as analytics.prepare_df
+        plus a per-symbol sequential trade_id: timestamp, symbol, price, qty,
+        trade_id. With `quotes`, returns a (trades, quotes) pair, the quotes
+        covering the same window at `quote_rate` with columns timestamp,
+        symbol, update_id, bid, bid_qty, ask, ask_qty.
+        """
+        if (n_ticks is None) == (duration is None):
+            raise ValueError("Pass exactly one of n_ticks or duration")
+
+        times, codes, end = self._arrivals(n_ticks, duration)
+        is_quote = np.zeros(len(times), dtype=bool)
+        if quotes:
+            # Quote updates share the event grid so they sit on the same paths
+            q_times, q_codes = self._quote_arrivals(end)
+            n_trades = len(times)
+            order = np.argsort(np.concatenate([times, q_times]), kind="stable")
+            times = np.concatenate([times, q_times])[order]
+            codes = np.concatenate([codes, q_codes])[order]
+            is_quote = order >= n_trades
+        n = len(times)
+
+        # Anchor GBM in log space, evaluated on the merged event grid
+        dt = np.diff(times, prepend=self.clock)
+        shocks = self.sigma * np.sqrt(dt) * self.rng.standard_normal(n)
+        anchor = self._anchor + np.cumsum(shocks - 0.5 * self.sigma ** 2 * dt)
+        if n:
+            self._anchor = anchor[-1]
+        self.clock = end
+
+        log_price = np.log(self.base[codes]) + self.betas[codes] * anchor
+        for i in range(1, len(self.symbols)):
+            mask = codes == i
+            ou, self._ou[i] = _ou_path(
+                times[mask], self._ou[i], self.theta, self.ou_sigma, self._ou_time[i], self.rng
+            )
+            if mask.any():
+                self._ou_time[i] = times[mask][-1]
+            log_price[mask] += ou
+        mid = np.exp(log_price)
+        timestamps = pd.to_datetime((times * 1e6).astype("int64"), unit="us")
+        names = np.asarray(self.symbols, dtype=object)[codes]
+
+        # Trades print at the bid or the ask around the latent mid
+        trade = ~is_quote
+        side = self.rng.choice([-1.0, 1.0], trade.sum())
+        price = mid[trade] * (1.0 + side * self.half_spread)
+
+        # Lognormal notional with a heavy right tail, rounded to a 0.001 lot
+        notional = self.median_notional * self.rng.lognormal(0.0, 1.2, len(price))
+        qty = np.maximum(np.round(notional / price, 3), 0.001)
+
+        trade_codes = codes[trade]
+        trade_id = np.empty(len(trade_codes), dtype=np.int64)
+        for i in range(len(self.symbols)):
+            mask = trade_codes == i
+            count = int(mask.sum())
+            trade_id[mask] = self._trade_id[i] + np.arange(1, count + 1)
+            self._trade_id[i] += count
+
+        trades = pd.DataFrame({
+            "timestamp": timestamps[trade],
+            "symbol": names[trade],
+            "price": price,
+            "qty": qty,
+            "trade_id": trade_id,
+        })
+        if not quotes:
+            return trades
+
+        q_mid = mid[is_quote]
+        m = len(q_mid)
+        # Resting size of a few typical trades on each side
+        depth = 5 * self.median_notional * self.rng.lognormal(0.0, 0.8, (2, m)) / q_mid
+        quotes_df = pd.DataFrame({
+            "timestamp": timestamps[is_quote],
+            "symbol": names[is_quote],
+            "update_id": self._update_id + np.arange(1, m + 1),
+            "bid": q_mid * (1.0 - self.half_spread),
+            "bid_qty": np.maximum(np.round(depth[0], 3), 0.001),
+            "ask": q_mid * (1.0 + self.half_spread),
+            "ask_qty": np.maximum(np.round(depth[1], 3), 0.001),
+        })
+        self._update_id += m
+        return trades, quotes_df
+
+
+def generate_ticks(symbols, n_ticks=None, duration=None, end=None, seed=None, quotes=False, **kwargs):
+    """
+    One-shot sample of a cointegrated market. With `duration`, the sample
+    ends at `end` (epoch seconds, defaults to now). With `quotes`, returns
+    a (trades, quotes) pair as SyntheticMarket.generate does.
+    """
+    start = None
+    if duration is not None:
+        start = (time.time() if end is None else end) - duration
+    market = SyntheticMarket(symbols, start=start, seed=seed, **kwargs)
+    return market.generate(n_ticks=n_ticks, duration=duration, quotes=quotes)
+
+
+def to_rows(df):
+    """
+    Convert generated ticks to storage rows (ISO timestamp, symbol, price,
+    qty, vwap, trades, trade_id)
+    """
+    ts = np.datetime_as_string(df["timestamp"].to_numpy(), unit="us")
+    price = df["price"].tolist()
+    return list(zip(
+        ts.tolist(), df["symbol"].tolist(), price, df["qty"].tolist(), price,
+        [1] * len(df), df["trade_id"].tolist()
+    ))
+
+
+def to_quote_rows(df, interval_ms):
+    """
+    Convert generated quotes to quote-store rows, keeping the last quote of
+    each symbol per `interval_ms` (see storage.insert_quotes)
+    """
+    ts_ms = df["timestamp"].to_numpy().astype("datetime64[ms]").astype("int64")
+    bucket = ts_ms // interval_ms * interval_ms if interval_ms else ts_ms
+    df = df.assign(ts=ts_ms, bucket=bucket).drop_duplicates(["symbol", "bucket"], keep="last")
+    columns = ["symbol", "bucket", "ts", "update_id", "bid", "bid_qty", "ask", "ask_qty"]
+    return list(zip(*(df[c].tolist() for c in columns)))
@@ -0,0 +1,352 @@
+"""
+Background analytics worker.
+
+Resampling, pivoting, the hedge regression and rolling statistics run on
+a worker thread that recomputes whenever new ticks land or the dashboard
+parameters change; the ADF test runs on a thread of its own and is merged
+into the latest snapshot when it finishes. Each result is published as a
+new, versioned AnalyticsSnapshot; the dashboard only ever reads the latest
+one, so a slow computation never blocks a rerun.
+"""
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import pandas as pd
+
+from storage import (
+    close_connections,
+    get_all_ticks,
+    get_tick_count,
+    get_bars,
+    get_quotes_at,
+    update_bar_pyramid,
+    timeframe_seconds,
+)
+from analytics import (
+    prepare_df,
+    spread_and_hedge,
+    zscore,
+    build_bars,
+    aligned_closes,
+    rolling_correlation,
+    adf_test,
+    quote_prices,
+    quote_closes,
+)
+from synthetic import generate_ticks
+from profiler import stage
+from config import (
+    SYNTHETIC_DEMO_SECONDS,
+    SYNTHETIC_SEED,
+    BAR_LEVELS,
+    WORKER_INTERVAL,
+    WORKER_ADF_INTERVAL,
+    WORKER_IDLE_TIMEOUT,
+)
+
+@dataclass(frozen=True)
+class AnalyticsParams:
+    symbols: tuple
+    timeframe: str
+    bar_threshold: Optional[float]
+    window: int
+    lookback: Optional[int] = None
+    price_source: str = "trade"
+
+@dataclass(frozen=True)
+class AnalyticsSnapshot:
+    """
+    One published result. Snapshots are never modified after publishing;
+    readers must treat the contained frames and series as read-only.
+    """
+    version: int
+    params: AnalyticsParams
+    created_at: float
+    compute_ms: float
+    demo: bool
+    tick_count: int
+    symbol_count: int
+    price_bars: pd.DataFrame
+    price_chart_df: pd.DataFrame
+    spread: Optional[pd.Series] = None
+    zs: Optional[pd.Series] = None
+    hedge: Optional[float] = None
+    rolling_corr: Optional[pd.Series] = None
+    adf_pvalue: Optional[float] = None
+    adf_at: Optional[float] = None
+    # Quote price source requested but no quotes stored: trade closes used
+    quotes_missing: bool = False
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+def tick_bars(df, params):
+    """Build bars for every symbol from raw ticks"""
+    resampled = []
+    for sym in params.symbols:
+        sym_df = df[df["symbol"] == sym][["timestamp", "price", "qty"]]
+        bars = build_bars(sym_df, params.timeframe, params.bar_threshold)
+        bars["symbol"] = sym
+        resampled.append(bars)
+    return pd.concat(resampled)
+
+def stored_quotes(price_bars, offset=None):
+    """
+    The last stored quote before each bar closes, per symbol. Event bars
+    close at their timestamp; clock bars, labelled by their start, at
+    `offset` later (exclusive).
+    """
+    ms = pd.Timedelta(milliseconds=1)
+    frames = []
+    for symbol, bars in price_bars.groupby("symbol"):
+        close_ms = (bars["timestamp"].astype("datetime64[ns]") - pd.Timestamp(0)) // ms
+        if offset is not None:
+            close_ms = close_ms + offset // ms - 1
+        frames.append(get_quotes_at(symbol, close_ms.tolist()))
+    if not frames:
+        return pd.DataFrame(columns=["timestamp", "symbol", "bid", "bid_qty", "ask", "ask_qty"])
+    return pd.concat(frames, ignore_index=True)
+
+def _closes(bars):
+    return (
+        bars
+        .pivot_table(
+            index="timestamp",
+            columns="symbol",
+            values="close",
+            aggfunc="last"
+        )
+        .sort_index()
+    )
+
+def compute_analytics(price_bars, params, close_bars=None):
+    """
+    Pivot and pair analytics on bar closes for one parameter set (no ADF).
+    The price chart always shows the trade closes of `price_bars`;
+    `close_bars` overrides the closes the pair analytics run on, e.g. with
+    quote prices.
+    """
+    with stage("worker.pivot"):
+        price_chart_df = _closes(price_bars)
+        closes = price_chart_df if close_bars is None else _closes(close_bars)
+
+    result = {"price_bars": price_bars, "price_chart_df": price_chart_df}
+    if len(params.symbols) < 2 or not set(params.symbols[:2]) <= set(closes.columns):
+        return result
+
+    with stage("worker.pair_analytics"):
+        s1, s2 = params.symbols[:2]
+
+        # Legs are aligned on the union of their bar timestamps, carrying
+        # the last close forward
+        df1, df2 = aligned_closes(closes, s1, s2)
+        if len(df1) < 2:
+            return result
+
+        spread, hedge = spread_and_hedge(df1, df2)
+        result.update(spread=spread, hedge=hedge, zs=zscore(spread, params.window))
+
+        if len(df1) >= params.window:
+            result["rolling_corr"] = rolling_correlation(
+                df1["price"], df2["price"], params.window
+            )
+
+    return result
+
+class AnalyticsWorker:
+    """
+    Recomputes analytics on its own thread. The dashboard calls
+    configure() with its current parameters on every rerun and reads
+    latest(). The thread exits after WORKER_IDLE_TIMEOUT seconds without
+    a reader.
+    """
+
+    def __init__(self, params):
+        self._params = params
+        self._snapshot = None
+        self._version = 0
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._last_read = time.time()
+        self.last_error = None
+        self._error_params = None
+        self._adf_thread = None
+        self._adf_key = None
+        self._adf_data = None
+        self._adf_started = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="analytics-worker")
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def configure(self, params):
+        """Set the parameters to compute for; wakes the worker on change"""
+        self._last_read = time.time()
+        if params != self._params:
+            self._params = params
+            self._wake.set()
+
+    def latest(self, timeout=0.0):
+        """
+        Latest snapshot, waiting up to `timeout` seconds for one computed
+        with the current parameters, unless computing them has failed.
+        Returns None if nothing is published yet.
+        """
+        self._last_read = time.time()
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._error_params == self._params or (
+                    self._snapshot is not None and self._snapshot.params == self._params
+                ),
+                timeout=timeout
+            )
+            return self._snapshot
+
+    def error(self, params):
+        """The last compute error for `params`, or None"""
+        with self._cond:
+            return self.last_error if self._error_params == params else None
+
+    def _run(self):
+        data_version = None
+
+        while time.time() - self._last_read < WORKER_IDLE_TIMEOUT:
+            params = self._params
+            update_bar_pyramid()
+            tick_count = get_tick_count()
+            current = self._snapshot
+
+            try:
+                if current is None or current.params != params or tick_count != data_version:
+                    current = self._compute(params, tick_count)
+                    data_version = tick_count
+                self._start_adf(current, data_version)
+                with self._cond:
+                    self.last_error = self._error_params = None
+            except Exception as e:
+                print(f"Error computing analytics: {e}")
+                with self._cond:
+                    self.last_error, self._error_params = e, params
+                    self._cond.notify_all()
+
+            self._wake.wait(WORKER_INTERVAL)
+            self._wake.clear()
+
+        close_connections()
+
+    def _start_adf(self, snapshot, data_version):
+        """
+        ADF is by far the slowest step (and the first call imports
+        statsmodels), so it runs on its own thread and never holds up the
+        bars. It reruns when the parameters change, or on new data at most
+        every WORKER_ADF_INTERVAL seconds, one run at a time.
+        """
+        if snapshot.spread is None or (self._adf_thread is not None and self._adf_thread.is_alive()):
+            return
+        key = (snapshot.params, snapshot.demo)
+        if key == self._adf_key and (
+            data_version == self._adf_data
+            or time.time() - self._adf_started < WORKER_ADF_INTERVAL
+        ):
+            return
+        self._adf_key, self._adf_data, self._adf_started = key, data_version, time.time()
+        self._adf_thread = threading.Thread(
+            target=self._run_adf, args=(key, snapshot.spread), daemon=True, name="analytics-adf"
+        )
+        self._adf_thread.start()
+
+    def _run_adf(self, key, spread):
+        try:
+            adf_pvalue = adf_test(spread)
+        except Exception as e:
+            print(f"Error running ADF test: {e}")
+            return
+        with self._cond:
+            current = self._snapshot
+            if current is not None and (current.params, current.demo) == key:
+                self._publish(replace(current, adf_pvalue=adf_pvalue, adf_at=time.time()))
+
+    def _compute(self, params, tick_count):
+        start = time.perf_counter()
+        with stage("worker.compute"):
+            since = None if params.lookback is None else time.time() - params.lookback
+            demo = tick_count == 0
+            use_quotes = params.price_source != "trade"
+            quotes = None
+            if not demo and params.timeframe in BAR_LEVELS:
+                # Clock bars come straight from the storage bar pyramid
+                with stage("worker.bars"):
+                    price_bars = get_bars(params.symbols, params.timeframe, start=since)
+                symbol_count = price_bars["symbol"].nunique()
+            else:
+                if demo:
+                    # Synthetic cointegrated sample for demo purposes
+                    df = generate_ticks(
+                        list(params.symbols) or ["btcusdt", "ethusdt"],
+                        duration=SYNTHETIC_DEMO_SECONDS,
+                        seed=SYNTHETIC_SEED,
+                        # Always drawn so every price source sees the same sample
+                        quotes=True
+                    )
+                    df, quotes = df
+                    if since is not None:
+                        quotes = quotes[quotes["timestamp"] >= pd.Timestamp(since, unit="s")]
+                    tick_count = len(df)
+                else:
+                    df = prepare_df(get_all_ticks())
+                if since is not None:
+                    df = df[df["timestamp"] >= pd.Timestamp(since, unit="s")]
+                symbol_count = df["symbol"].nunique()
+                with stage("worker.bars"):
+                    price_bars = tick_bars(df, params)
+            close_bars = None
+            quotes_missing = False
+            if use_quotes:
+                # Closes sampled from the quotes instead of the last trade,
+                # which bounces between bid and ask
+                offset = None
+                if params.timeframe in BAR_LEVELS:
+                    offset = pd.Timedelta(seconds=timeframe_seconds(params.timeframe))
+                if quotes is None:
+                    # Only the quote at each bar close is read from storage
+                    with stage("worker.quotes"):
+                        quotes = stored_quotes(price_bars, offset)
+                quotes_missing = quotes.empty
+            if use_quotes and not quotes_missing:
+                with stage("worker.quotes"):
+                    close_bars = quote_closes(
+                        price_bars, quote_prices(quotes, params.price_source), offset
+                    )
+            result = compute_analytics(price_bars, params, close_bars)
+
+        return self._publish(AnalyticsSnapshot(
+            version=0,
+            params=params,
+            created_at=time.time(),
+            compute_ms=(time.perf_counter() - start) * 1000,
+            demo=demo,
+            tick_count=tick_count,
+            symbol_count=symbol_count,
+            quotes_missing=quotes_missing,
+            **result,
+        ))
+
+    def _publish(self, snapshot):
+        """Publish as the next version, keeping the last ADF result while it still applies"""
+        with self._cond:
+            current = self._snapshot
+            if (
+                snapshot.adf_at is None and current is not None
+                and (current.params, current.demo) == (snapshot.params, snapshot.demo)
+            ):
+                snapshot = replace(snapshot, adf_pvalue=current.adf_pvalue, adf_at=current.adf_at)
+            snapshot = replace(snapshot, version=self._version + 1)
+            self._snapshot = snapshot
+            self._version = snapshot.version
+            self._cond.notify_all()
+        return snapshot